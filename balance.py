@@ -0,0 +1,155 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+import main
+
+# These are the settings of the game that can be changed with --set to try out a different balance. The ammo and
+# obstacle speed of a difficulty are changed with names like Hard.ammo or Easy.obstacle_speed.
+BALANCE_CONSTANTS = ['SPEED_UP_TICKS', 'SPEED_UP_AMOUNT', 'OBSTACLE_SPAWN_CHANCE', 'COIN_SPAWN_CHANCE',
+                     'AMMO_SPAWN_CHANCE']
+
+# These are the percentiles shown for each result.
+PERCENTILES = [("p10", 0.10), ("p25", 0.25), ("p50", 0.50), ("p75", 0.75), ("p90", 0.90)]
+
+
+def parse_setting(text):
+    # This is to read one --set option like OBSTACLE_SPAWN_CHANCE=40 or Hard.ammo=2 into a name and a number.
+    name, _, value = text.partition('=')
+    difficulty, _, setting = name.partition('.')
+    if name not in BALANCE_CONSTANTS and not (difficulty in main.DIFFICULTY_SETTINGS and
+                                              setting in main.DIFFICULTY_SETTINGS[difficulty]):
+        raise argparse.ArgumentTypeError(f"{name} is not a setting that can be changed")
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value!r} is not a number")
+    return name, int(number) if number.is_integer() else number
+
+
+def apply_settings(settings):
+    # This is to change the settings of the game in this process. It is run in every worker of the process pool before
+    # it plays any games, so all the games are played with the same settings.
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    for name, value in settings:
+        if name in BALANCE_CONSTANTS:
+            setattr(main, name, value)
+        else:
+            difficulty, setting = name.split('.')
+            main.DIFFICULTY_SETTINGS[difficulty][setting] = value
+
+
+def play_game(job):
+    # This is to play one headless game with the bot. It is run by the workers of the process pool.
+    difficulty, seed, max_ticks, engine = job
+    return main.run_headless(difficulty, seed, max_ticks, engine=engine)
+
+
+def distribution(values):
+    # This is to turn a list of numbers into the mean, the percentiles and the smallest and largest.
+    values = sorted(values)
+    result = {"mean": round(sum(values) / len(values), 2), "min": values[0]}
+    for name, fraction in PERCENTILES:
+        result[name] = round(values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))], 2)
+    result["max"] = values[-1]
+    return result
+
+
+def summarize_games(games):
+    # This is to work out the distributions of one difficulty from the results of its games. The survival time is in
+    # seconds and the coin income is the coins collected for each minute survived.
+    minutes = [max(game["ticks"], 1) / main.TICKS_PER_SECOND / 60 for game in games]
+    return {
+        "games": len(games),
+        "reached_max_ticks": sum(1 for game in games if not game["game_over"]),
+        "survival_seconds": distribution([game["ticks"] / main.TICKS_PER_SECOND for game in games]),
+        "score": distribution([game["score"] for game in games]),
+        "coins": distribution([game["coins"] for game in games]),
+        "coins_per_minute": distribution([game["coins"] / minute for game, minute in zip(games, minutes)]),
+        "shots": distribution([game["shots"] for game in games]),
+        "ammo_left": distribution([game["ammo_left"] for game in games])
+    }
+
+
+def run_sweep(difficulties, games, first_seed, max_ticks, workers, engine, settings):
+    # This is to play the games of every difficulty on a pool of processes, one seed for each game. Every difficulty
+    # plays the same seeds so they can be compared fairly. The games are handed to the workers in chunks so sending
+    # them does not take longer than playing them.
+    jobs = [(difficulty, seed, max_ticks, engine) for difficulty in difficulties
+            for seed in range(first_seed, first_seed + games)]
+    chunk_size = max(1, len(jobs) // (workers * 16))
+    results = {difficulty: [] for difficulty in difficulties}
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=apply_settings,
+                                                initargs=(settings,)) as pool:
+        for result in pool.map(play_game, jobs, chunksize=chunk_size):
+            results[result["difficulty"]].append(result)
+    return {difficulty: summarize_games(results[difficulty]) for difficulty in difficulties}
+
+
+def print_summary(summary):
+    # This is to print a short table of the median and the spread of each result for every difficulty.
+    for difficulty, stats in summary.items():
+        print(f"{difficulty:8} games {stats['games']}  reached max ticks {stats['reached_max_ticks']}")
+        for name in ("survival_seconds", "score", "coins", "coins_per_minute", "shots", "ammo_left"):
+            values = stats[name]
+            print(f"{'':8}   {name:17} mean {values['mean']:9.2f}  p10 {values['p10']:9.2f}  "
+                  f"p50 {values['p50']:9.2f}  p90 {values['p90']:9.2f}  max {values['max']:9.2f}")
+
+
+def parse_args(argv=None):
+    # This is to read the options of the balance sweep from the command line.
+    parser = argparse.ArgumentParser(description="Play many headless Raccoon Madness games to balance the difficulties")
+    parser.add_argument('--games', type=int, default=1000, help="games to play on each difficulty")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first game, the rest count up from it")
+    parser.add_argument('--difficulty', action='append', choices=main.DIFFICULTY_LEVELS,
+                        help="only play this difficulty, can be given more than once")
+    parser.add_argument('--max-ticks', type=int, default=10 * 60 * main.TICKS_PER_SECOND,
+                        help="stop a game after this many ticks, the default is 10 minutes")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="processes to play the games on")
+    parser.add_argument('--engine', choices=list(main.SESSION_ENGINES), default='objects',
+                        help="play with the entities as objects or in NumPy arrays")
+    parser.add_argument('--set', dest='settings', action='append', type=parse_setting, default=[],
+                        metavar='NAME=VALUE',
+                        help="change a setting for the sweep, e.g. OBSTACLE_SPAWN_CHANCE=40 or Hard.ammo=2, "
+                             f"the settings are {', '.join(BALANCE_CONSTANTS)} and Difficulty.ammo or "
+                             "Difficulty.obstacle_speed")
+    parser.add_argument('--output', help="write the distributions to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main_balance(argv=None):
+    # This is the start of the balance sweep. It plays the games, prints the distributions of every difficulty and
+    # saves them with the settings that were used.
+    args = parse_args(argv)
+    difficulties = args.difficulty or main.DIFFICULTY_LEVELS
+    start = time.perf_counter()
+    summary = run_sweep(difficulties, args.games, args.seed, args.max_ticks, args.workers, args.engine,
+                        args.settings)
+    seconds = time.perf_counter() - start
+    print_summary(summary)
+    print(f"Played {args.games * len(difficulties)} games on {args.workers} processes in {seconds:.1f} s")
+    if args.output:
+        apply_settings(args.settings)
+        results = {
+            "meta": {
+                "games": args.games,
+                "seed": args.seed,
+                "max_ticks": args.max_ticks,
+                "engine": args.engine,
+                "seconds": round(seconds, 1),
+                "settings": {name: getattr(main, name) for name in BALANCE_CONSTANTS},
+                "difficulty_settings": main.DIFFICULTY_SETTINGS
+            },
+            "difficulties": summary
+        }
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_balance())
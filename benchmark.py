@@ -0,0 +1,264 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pygame
+
+import main
+
+# The benchmark runs from the game folder so the fonts, images and sounds can be found. It uses the dummy video and
+# audio drivers unless a real window is asked for, so it can run on a computer with no screen.
+GAME_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+# These are the scenarios the benchmark plays. There is one for each difficulty and a long run on Expert where the game
+# has already sped up every 10 seconds for five minutes, so the obstacles move much faster than at the start.
+SCENARIOS = [{"name": level, "difficulty": level, "speed_ups": 0} for level in main.DIFFICULTY_LEVELS]
+SCENARIOS.append({"name": "Long run", "difficulty": "Expert", "speed_ups": 30})
+
+# A phase only counts as slower than the baseline if it got slower by more than this many milliseconds, so tiny
+# phases that are mostly timer noise do not fail the comparison.
+MINIMUM_REGRESSION_MS = 0.02
+
+
+def percentile(sorted_values, fraction):
+    # This is to get a percentile from a list of values that is already sorted.
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(seconds):
+    # This is to turn a list of times in seconds into the mean, p50, p95, p99 and max in milliseconds.
+    values = sorted(value * 1000 for value in seconds)
+    return {
+        "mean": round(sum(values) / len(values), 4) if values else 0.0,
+        "p50": round(percentile(values, 0.50), 4),
+        "p95": round(percentile(values, 0.95), 4),
+        "p99": round(percentile(values, 0.99), 4),
+        "max": round(values[-1], 4) if values else 0.0
+    }
+
+
+def start_session(session, scenario, seed):
+    # This is to start a new game for the scenario. For the long run the speed ups are applied straight away, the same
+    # as if the game had been played for that long. A checkpoint scenario carries on from the game in the checkpoint.
+    if scenario.get("checkpoint"):
+        session.reset(main.DIFFICULTY_LEVELS[0], seed)
+        session.restore(scenario["checkpoint"])
+        return
+    session.reset(scenario["difficulty"], seed)
+    for _ in range(scenario["speed_ups"]):
+        session.obstacle_speed += main.SPEED_UP_AMOUNT
+        session.background_speed += main.SPEED_UP_AMOUNT
+    session.tick = scenario["speed_ups"] * main.SPEED_UP_TICKS
+    # The spawns are planned again from the new tick, otherwise every spawn before it would be due at once.
+    session.spawner.reset(session.tick)
+
+
+def play_scenario(scenario, frames, seed, render, engine):
+    # This is to play the scenario for a number of frames with the bot. Each frame runs one tick and, when rendering,
+    # draws the game and flips the screen. When the bot loses, a new game starts with the next seed. It returns the
+    # profiler sample of every frame and the number of entities on the screen in every frame.
+    profiler = main.FrameProfiler()
+    session = main.SESSION_ENGINES[engine](seed=seed)
+    session.profiler = profiler
+    games = 1
+    start_session(session, scenario, seed)
+    frame_times = []
+    phase_samples = []
+    entity_samples = []
+    for _ in range(frames):
+        if session.game_over:
+            start_session(session, scenario, seed + games)
+            games += 1
+        move_left, move_right, shoot = main.bot_policy(session)
+        if shoot:
+            session.shoot()
+        frame_start = time.perf_counter()
+        session.step(move_left, move_right)
+        if render:
+            profiler.begin('draw')
+            session.draw(main.screen)
+            main.draw_hud(session)
+            profiler.end()
+            profiler.begin('flip')
+            pygame.display.flip()
+            profiler.end()
+        frame_times.append(time.perf_counter() - frame_start)
+        phase_samples.append(profiler.end_frame(scenario["name"]))
+        entity_samples.append(sum(session.entity_counts().values()))
+    return frame_times, phase_samples, entity_samples, games
+
+
+def run_scenario(scenario, frames, seed, render, allocation_frames, engine):
+    # This is to run one scenario and work out its results. The timed run counts the garbage collections and the
+    # memory blocks that were left allocated. The allocations are measured in a second, shorter run with tracemalloc,
+    # because tracing every allocation makes the game much slower and would spoil the timings.
+    gc.collect()
+    collections_before = [stats["collections"] for stats in gc.get_stats()]
+    blocks_before = sys.getallocatedblocks()
+    frame_times, phase_samples, entity_samples, games = play_scenario(scenario, frames, seed, render, engine)
+    blocks_after = sys.getallocatedblocks()
+    collections_after = [stats["collections"] for stats in gc.get_stats()]
+
+    tracemalloc.start()
+    play_scenario(scenario, allocation_frames, seed, render, engine)
+    traced_current, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    phase_names = sorted({name for sample in phase_samples for name in sample["phases"]})
+    phases = {"frame": summarize(frame_times)}
+    for name in phase_names:
+        phases[name] = summarize([sample["phases"].get(name, 0.0) for sample in phase_samples])
+    counter_names = sorted({name for sample in phase_samples for name in sample["counters"]})
+    counters = {name: round(sum(sample["counters"].get(name, 0) for sample in phase_samples) / len(phase_samples), 2)
+                for name in counter_names}
+    sorted_entities = sorted(entity_samples)
+    return {
+        "difficulty": scenario["difficulty"],
+        "speed_ups": scenario["speed_ups"],
+        "frames": frames,
+        "games": games,
+        "phases_ms": phases,
+        "counters_per_frame": counters,
+        "entities": {
+            "mean": round(sum(entity_samples) / len(entity_samples), 2),
+            "p95": percentile(sorted_entities, 0.95),
+            "max": sorted_entities[-1]
+        },
+        "allocations": {
+            "gc_collections": [after - before for before, after in zip(collections_before, collections_after)],
+            "blocks_left": blocks_after - blocks_before,
+            "traced_frames": allocation_frames,
+            "traced_peak_kib": round(traced_peak / 1024, 1),
+            "traced_current_kib": round(traced_current / 1024, 1)
+        }
+    }
+
+
+def compare_with_baseline(results, baseline, threshold):
+    # This is to compare the results with a baseline file. A phase is a regression when its p50 or p95 is more than
+    # the threshold slower than the baseline. It returns a list of messages, one for each regression.
+    regressions = []
+    for name, scenario in results["scenarios"].items():
+        old_scenario = baseline.get("scenarios", {}).get(name)
+        if old_scenario is None:
+            continue
+        for phase, timings in scenario["phases_ms"].items():
+            old_timings = old_scenario["phases_ms"].get(phase)
+            if old_timings is None:
+                continue
+            for stat in ("p50", "p95"):
+                old, new = old_timings[stat], timings[stat]
+                if new > old * (1 + threshold) and new - old > MINIMUM_REGRESSION_MS:
+                    regressions.append(f"{name} {phase} {stat}: {old:.3f} ms -> {new:.3f} ms")
+    return regressions
+
+
+def print_results(results):
+    # This is to print a short table of the results.
+    for name, scenario in results["scenarios"].items():
+        frame = scenario["phases_ms"]["frame"]
+        print(f"{name:10} frame p50 {frame['p50']:.3f} ms  p95 {frame['p95']:.3f} ms  p99 {frame['p99']:.3f} ms  "
+              f"entities max {scenario['entities']['max']}  games {scenario['games']}")
+        for phase, timings in scenario["phases_ms"].items():
+            if phase != "frame":
+                print(f"{'':10}   {phase:10} p50 {timings['p50']:.3f}  p95 {timings['p95']:.3f}  "
+                      f"p99 {timings['p99']:.3f}")
+
+
+def parse_args(argv=None):
+    # This is to read the options of the benchmark from the command line.
+    parser = argparse.ArgumentParser(description="Benchmark the Raccoon Madness game loop")
+    parser.add_argument('--frames', type=int, default=3000, help="frames to play in each scenario")
+    parser.add_argument('--allocation-frames', type=int, default=500,
+                        help="frames to play with tracemalloc to measure the allocations")
+    parser.add_argument('--seed', type=int, default=1, help="seed of the first game in each scenario")
+    parser.add_argument('--scenario', action='append', choices=[scenario["name"] for scenario in SCENARIOS],
+                        help="only run this scenario, can be given more than once")
+    parser.add_argument('--engine', choices=list(main.SESSION_ENGINES), default='objects',
+                        help="play with the entities as objects or in NumPy arrays")
+    parser.add_argument('--checkpoint', help="only run one scenario that starts from this checkpoint file")
+    parser.add_argument('--no-render', action='store_true', help="only time the game logic, do not draw")
+    parser.add_argument('--window', action='store_true', help="draw to a real window instead of the dummy driver")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare the results with this JSON file")
+    parser.add_argument('--save-baseline', help="write the results to this JSON file to use as a baseline later")
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help="how much slower than the baseline counts as a regression, 0.15 is 15%%")
+    return parser.parse_args(argv)
+
+
+def main_benchmark(argv=None):
+    # This is the start of the benchmark. It opens the game window if the scenarios are drawn, plays every scenario,
+    # prints and saves the results and compares them with the baseline. It returns 1 if there was a regression.
+    args = parse_args(argv)
+    # The paths of the result files are worked out before moving to the game folder.
+    for option in ('output', 'baseline', 'save_baseline', 'checkpoint'):
+        if getattr(args, option):
+            setattr(args, option, os.path.abspath(getattr(args, option)))
+    os.chdir(GAME_FOLDER)
+    if not args.window:
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    render = not args.no_render
+    if render:
+        # The drawing needs a player profile for the equipped skin and ammo. A default one is made in a temporary
+        # folder so the real saved data is never touched.
+        with tempfile.TemporaryDirectory() as folder:
+            saver = main.ProfileSaver(os.path.join(folder, 'game_data.json'), os.path.join(folder, 'score.txt'))
+            main.profile = saver.load()
+        main.init_window()
+        main.finish_loading()
+
+    scenarios = [scenario for scenario in SCENARIOS if not args.scenario or scenario["name"] in args.scenario]
+    if args.checkpoint:
+        with open(args.checkpoint, 'rb') as f:
+            checkpoint = f.read()
+        session = main.GameSession()
+        session.restore(checkpoint)
+        scenarios = [{"name": "Checkpoint", "difficulty": session.difficulty, "speed_ups": 0,
+                      "checkpoint": checkpoint}]
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "platform": platform.platform(),
+            "frames": args.frames,
+            "seed": args.seed,
+            "engine": args.engine,
+            "render": render
+        },
+        "scenarios": {}
+    }
+    for scenario in scenarios:
+        results["scenarios"][scenario["name"]] = run_scenario(
+            scenario, args.frames, args.seed, render, args.allocation_frames, args.engine)
+    print_results(results)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            return 1
+        print("No regressions compared with the baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_benchmark())
@@ -0,0 +1,206 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy
+import pygame
+
+import main
+
+# These are the actions an automated player can take each tick, by their number in this list.
+ACTIONS = ['none', 'left', 'right', 'shoot']
+
+# These are the kinds of entity in the entity observations. The kind is stored as its number in this list plus one, so
+# an empty row of the table is all zeros.
+ENTITY_KINDS = ['obstacle', 'bullet', 'ammo', 'coin', 'explosion']
+
+
+def start_rendering():
+    # This is to open the game window and load the images, which the games need to be drawn. The drawing uses the
+    # equipped skin and ammo of a player profile, so a default one is made in a temporary folder and the real saved
+    # data is never touched. Without a screen the dummy video driver is used.
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    if main.screen is None:
+        with tempfile.TemporaryDirectory() as folder:
+            saver = main.ProfileSaver(os.path.join(folder, 'game_data.json'), os.path.join(folder, 'score.txt'))
+            main.profile = saver.load()
+        main.init_window()
+        main.finish_loading()
+
+
+class VectorEnvironment:
+    def __init__(self, games, difficulty='Easy', engine='objects', render=False, max_entities=32, max_ticks=None):
+        # This is a number of independent games of Raccoon Madness that move forward together, one tick for each call
+        # of step, for training and testing automated players. It is the PLAYING part of the game loop without the
+        # window, so each game is a GameSession. The observations are NumPy arrays that are made once and filled in
+        # place on every step, so they are never allocated again. If they need to be kept they have to be copied.
+        #   player has a row for each game with its lane, ammo, obstacle speed and tick.
+        #   lanes has how far above the player the closest obstacle, ammo pickup and coin are in each lane, as a
+        #   fraction of the screen height, or 1 when there is nothing above the player in that lane.
+        #   entities has a row for up to max_entities entities of each game with the kind, x, y and lane.
+        # When render is True every game is also drawn each step into frames, which are the pixels of the game
+        # surfaces themselves, so reading them does not copy anything.
+        self.games = games
+        self.difficulty = difficulty
+        self.max_ticks = max_ticks
+        self.sessions = [main.SESSION_ENGINES[engine](seed=i) for i in range(games)]
+        self.next_seed = 0
+        self.player = numpy.zeros((games, 4), numpy.float32)
+        self.lanes = numpy.zeros((games, main.LANE_COUNT, 3), numpy.float32)
+        self.entities = numpy.zeros((games, max_entities, 4), numpy.float32)
+        self.observations = {"player": self.player, "lanes": self.lanes, "entities": self.entities}
+        self.rewards = numpy.zeros(games, numpy.float32)
+        self.terminated = numpy.zeros(games, bool)
+        self.truncated = numpy.zeros(games, bool)
+        # These are the results of the games that ended in the last step. A game that ended starts again straight
+        # away with a new seed, so its observation is already the start of the next game.
+        self.final_scores = numpy.zeros(games, numpy.int32)
+        self.final_ticks = numpy.zeros(games, numpy.int32)
+        self.infos = {"final_score": self.final_scores, "final_ticks": self.final_ticks}
+        self.frames = None
+        self.surfaces = []
+        if render:
+            start_rendering()
+            # Every game is drawn into a surface that uses its part of the frames array as its pixels. The pixels are
+            # red, green, blue and an unused byte, so observations["frames"] only has the colours.
+            pixels = numpy.zeros((games, main.SCREEN_HEIGHT, main.SCREEN_WIDTH, 4), numpy.uint8)
+            self.surfaces = [pygame.image.frombuffer(pixels[i], (main.SCREEN_WIDTH, main.SCREEN_HEIGHT), 'RGBX')
+                             for i in range(games)]
+            self.frames = pixels[..., :3]
+            self.observations["frames"] = self.frames
+
+    def reset(self, seed=0):
+        # This is to start every game again. Game i uses seed + i, and the games that start after one ends use the
+        # seeds that come after those. It returns the observations.
+        for i, session in enumerate(self.sessions):
+            session.reset(self.difficulty, seed + i)
+            self.observe(i)
+        self.next_seed = seed + self.games
+        self.rewards[:] = 0
+        self.terminated[:] = False
+        self.truncated[:] = False
+        self.final_scores[:] = 0
+        self.final_ticks[:] = 0
+        self.draw()
+        return self.observations
+
+    def step(self, actions):
+        # This is to play one tick of every game with its action from ACTIONS. The reward is the score gained in the
+        # tick. A game is terminated when the player hits an obstacle and truncated when it reaches max_ticks, and
+        # then it starts again with the next seed. It returns the observations, rewards, terminated, truncated and
+        # infos, like a gym vector environment.
+        for i, session in enumerate(self.sessions):
+            action = actions[i]
+            if action == 3:
+                session.shoot()
+            score = session.score
+            session.step(action == 1, action == 2)
+            self.rewards[i] = session.score - score
+            self.terminated[i] = session.game_over
+            self.truncated[i] = not session.game_over and self.max_ticks is not None and \
+                session.tick >= self.max_ticks
+            if self.terminated[i] or self.truncated[i]:
+                self.final_scores[i] = session.score
+                self.final_ticks[i] = session.tick
+                session.reset(self.difficulty, self.next_seed)
+                self.next_seed += 1
+            else:
+                self.final_scores[i] = 0
+                self.final_ticks[i] = 0
+            self.observe(i)
+        self.draw()
+        return self.observations, self.rewards, self.terminated, self.truncated, self.infos
+
+    def observe(self, i):
+        # This is to fill in the observations of game i.
+        session = self.sessions[i]
+        player = session.player
+        self.player[i] = (player.current_lane, player.ammo, session.obstacle_speed, session.tick)
+
+        lanes = self.lanes[i]
+        for lane in range(main.LANE_COUNT):
+            for column, index in enumerate((session.obstacle_index, session.ammo_index, session.coin_index)):
+                top = index.lowest_top(lane, player.rect.top)
+                lanes[lane, column] = 1.0 if top is None else (player.rect.top - top) / main.SCREEN_HEIGHT
+
+        entities = self.entities[i]
+        entities[:] = 0
+        row = 0
+        for kind, pool in enumerate((session.obstacle_pool, session.bullet_pool, session.ammo_pool,
+                                     session.coin_pool, session.explosion_pool), 1):
+            count = min(len(pool), len(entities) - row)
+            if isinstance(pool, main.EntityArrays):
+                # The NumPy engine already has the entities in arrays, so they are copied in one go.
+                entities[row:row + count, 0] = kind
+                entities[row:row + count, 1] = pool['x'][:count]
+                entities[row:row + count, 2] = pool['y'][:count]
+                entities[row:row + count, 3] = pool['lane'][:count]
+                row += count
+            else:
+                for entity in pool.active[:count]:
+                    # The position of a bullet is its left beam, the same as in the NumPy engine.
+                    rect = entity.left_beam if kind == 2 else entity.rect
+                    entities[row] = (kind, rect.x, rect.y, getattr(entity, 'lane', 0))
+                    row += 1
+
+    def draw(self):
+        # This is to draw every game into its frame, if the games are rendered.
+        for surface, session in zip(self.surfaces, self.sessions):
+            session.draw(surface)
+
+
+def random_policy(rng, games):
+    # This is to pick a random action for every game.
+    return rng.integers(0, len(ACTIONS), games)
+
+
+def bot_actions(environment, actions):
+    # This is to pick the action of the headless bot for every game, to have an automated player to compare with.
+    for i, session in enumerate(environment.sessions):
+        move_left, move_right, shoot = main.bot_policy(session)
+        actions[i] = 3 if shoot else 1 if move_left else 2 if move_right else 0
+    return actions
+
+
+def parse_args(argv=None):
+    # This is to read the options of the throughput test from the command line.
+    parser = argparse.ArgumentParser(description="Measure how many game steps per second the environment plays")
+    parser.add_argument('--games', type=int, default=64, help="games played together")
+    parser.add_argument('--steps', type=int, default=1000, help="steps to play")
+    parser.add_argument('--difficulty', choices=main.DIFFICULTY_LEVELS, default=main.DIFFICULTY_LEVELS[0])
+    parser.add_argument('--engine', choices=list(main.SESSION_ENGINES), default='objects',
+                        help="play with the entities as objects or in NumPy arrays")
+    parser.add_argument('--policy', choices=['random', 'bot'], default='random', help="how the actions are picked")
+    parser.add_argument('--render', action='store_true', help="also draw every game into the frames")
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main_environment(argv=None):
+    # This is to play the games with a policy and print how many steps of a single game are played each second, across
+    # all the games, which is the number that matters when training automated players.
+    args = parse_args(argv)
+    environment = VectorEnvironment(args.games, args.difficulty, args.engine, args.render)
+    environment.reset(args.seed)
+    rng = numpy.random.default_rng(args.seed)
+    actions = numpy.zeros(args.games, numpy.int64)
+    games_finished = 0
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        if args.policy == 'bot':
+            bot_actions(environment, actions)
+        else:
+            actions = random_policy(rng, args.games)
+        _, _, terminated, truncated, _ = environment.step(actions)
+        games_finished += int(numpy.count_nonzero(terminated | truncated))
+    seconds = time.perf_counter() - start
+    print(f"{args.steps * args.games / seconds:.0f} steps per second with {args.games} games, "
+          f"{games_finished} games finished")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_environment())
@@ -1,75 +1,639 @@
+import argparse
+import bisect
+import collections
+import concurrent.futures
+import csv
+import hashlib
 import json
+import math
+import mmap
 import os
 import pygame
 import random
+import struct
+import sys
+import tempfile
+import threading
+import time
 
-pygame.init()
+try:
+    import numpy
+except ImportError:
+    numpy = None  # NumPy is only needed for the optional NumPy engine, the game runs without it.
+
+# This is when the game started, to measure how long it takes until the first frame and the home page are shown.
+PROCESS_START = time.perf_counter()
 
 # This is to set the dimensions for the video game to keep consistency throughout the code.
 SCREEN_WIDTH = 600
 SCREEN_HEIGHT = 800
 LANE_WIDTH = SCREEN_WIDTH // 5
 LANE_POSITIONS = [(SCREEN_WIDTH // 5) * i + (SCREEN_WIDTH // 10) for i in range(5)]
+LANE_COUNT = len(LANE_POSITIONS)
 OBSTACLE_WIDTH, OBSTACLE_HEIGHT = 50, 50
 PLAYER_WIDTH, PLAYER_HEIGHT = 50, 80
 AMMO_WIDTH, AMMO_HEIGHT = 30, 30
 BULLET_WIDTH, BULLET_HEIGHT = 10, 20
 COIN_WIDTH, COIN_HEIGHT = 360, 30
 
+# This is the fixed rate the game logic runs at. All the speeds, delays and spawn chances are per tick, so the game
+# plays the same no matter how many frames per second the screen is drawn at.
+TICKS_PER_SECOND = 60
+TICK_SECONDS = 1 / TICKS_PER_SECOND
+SPEED_UP_TICKS = 10 * TICKS_PER_SECOND  # The game speeds up every 10 seconds of play.
+SPEED_UP_AMOUNT = 0.25  # This is how many pixels per tick faster everything moves each time the game speeds up.
+# These are the chances of something spawning each tick, 1 in this many.
+OBSTACLE_SPAWN_CHANCE = 50
+COIN_SPAWN_CHANCE = 200
+AMMO_SPAWN_CHANCE = 150
+SPAWN_LOOKAHEAD_TICKS = TICKS_PER_SECOND  # This is how far ahead the spawns are planned.
+MOVE_DELAY_TICKS = 10  # Number of ticks between each lane change while an arrow key is held.
+# This is the frame rate the gameplay is drawn at, and the longest frame that is simulated at once so the game does
+# not try to catch up forever after the window was dragged or the computer was busy.
+FRAME_RATE = 60
+MAX_FRAME_SECONDS = 0.25
+# These are the most frames per second each page of the game is drawn at. The menus barely move, so they do not need
+# as many frames as the gameplay.
+STATE_FRAME_RATES = {'HOME': 30, 'STORE': 30, 'STORY': 30, 'CONTROLS': 30, 'PLAYING': FRAME_RATE, 'GAME_OVER': 30}
+MENU_SCROLL_SPEED = 9  # This is how many pixels per second the background of the menus moves.
+# This is the longest time the game waits for an event when nothing on the screen is changing, so the frame rate on the
+# overlay and the music keep up to date.
+IDLE_TIMEOUT_MS = 500
+
+
+# This is the folder of the baked images. The first time an image is loaded it is decoded and scaled, and its raw
+# pixels are saved here in the same pixel format as the screen. After that the raw pixels are mapped straight from the
+# file, which is much quicker than decoding the PNG and scaling it again. The name of each file is a hash of the image
+# file's contents and the size, so changing an image or its size makes a new one.
+BAKED_ASSET_FOLDER = '.asset_cache'
+BAKE_VERSION = 2
+BAKED_PIXEL_FORMAT = 'BGRA' if sys.byteorder == 'little' else 'ARGB'
+BAKED_HEADER = struct.Struct('<II')  # This is the width and the height at the start of each baked file.
+
+
+def baked_image_path(path, width=None, height=None):
+    # This is to get the path of the baked file of an image at a size.
+    with open(path, 'rb') as f:
+        digest = hashlib.sha1(f.read())
+    digest.update(f"{width}x{height}:{BAKED_PIXEL_FORMAT}:{BAKE_VERSION}".encode())
+    return os.path.join(BAKED_ASSET_FOLDER, digest.hexdigest() + '.raw')
+
+
+def load_baked_image(baked_path):
+    # This is to load a baked image. The file is memory mapped and the surface uses the mapped pixels, so nothing is
+    # decoded or copied until the image is converted for the screen.
+    with open(baked_path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    width, height = BAKED_HEADER.unpack_from(data)
+    return pygame.image.frombuffer(memoryview(data)[BAKED_HEADER.size:], (width, height), BAKED_PIXEL_FORMAT)
+
+
+def bake_image(image, baked_path):
+    # This is to save the raw pixels of a decoded and scaled image as a baked file.
+    os.makedirs(BAKED_ASSET_FOLDER, exist_ok=True)
+    write_file_atomic(baked_path, BAKED_HEADER.pack(*image.get_size()) +
+                      pygame.image.tobytes(image, BAKED_PIXEL_FORMAT))
+
 
 def load_image(path, width=None, height=None):
-    # This function was created to load the images to get rid of repetitive code for loading images
+    # This function was created to load the images to get rid of repetitive code for loading images. It uses the baked
+    # file of the image if there is one, and otherwise decodes and scales the image and bakes it for next time.
+    frame_profiler.count('disk_loads')
+    baked_path = baked_image_path(path, width, height)
+    if os.path.exists(baked_path):
+        try:
+            return load_baked_image(baked_path)
+        except (OSError, ValueError, struct.error, pygame.error):
+            # A broken baked file is made again from the image.
+            pass
     image = pygame.image.load(path)
     if width and height:
         image = pygame.transform.scale(image, (width, height))
+    # The raw pixels of a baked file have no colour key, so an image whose see-through parts are a colour key, like the
+    # palette PNGs, is copied onto a see-through surface first. Then the decoded and the baked image look the same.
+    surface = pygame.Surface(image.get_size(), pygame.SRCALPHA)
+    surface.blit(image, (0, 0))
+    image = surface
+    try:
+        bake_image(image, baked_path)
+    except OSError:
+        # If the folder cannot be written to, the game still works, it just decodes the image every time.
+        pass
     return image
 
 
+# This is the shared asset cache. Every image and sprite sheet is decoded from the disk once per process and then
+# reused by every entity, page and frame. The key is the path, the target size and the convert mode so the same file
+# can be cached at different sizes.
+ASSET_CACHE = {}
+
+
+class AssetLoader:
+    def __init__(self, workers=4):
+        # This is to load images and sounds from the disk on other threads while the game shows the loading screen or
+        # the home page. Decoding and scaling the files happens on the threads, and the asset is only taken and
+        # converted for the screen when the game first needs it. An asset that was never started here is just loaded
+        # straight away when it is needed.
+        self.workers = workers
+        self.pool = None
+        self.pending = {}
+
+    def start(self):
+        # This is to start the threads.
+        if self.pool is None:
+            self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers,
+                                                              thread_name_prefix='asset_loader')
+
+    def submit(self, key, load, *args):
+        # This is to start loading an asset on the threads if it is not cached or loading already.
+        if self.pool is not None and key not in ASSET_CACHE and key not in self.pending:
+            self.pending[key] = self.pool.submit(load, *args)
+
+    def stop(self):
+        # This is to stop the threads before pygame is closed. Assets that have not started loading are cancelled.
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+            self.pending = {}
+
+    def take(self, key):
+        # This is to get an asset that was loading on the threads, waiting for it if it is not finished yet. It returns
+        # None if the asset was never started.
+        future = self.pending.pop(key, None)
+        if future is None:
+            return None
+        return future.result()
+
+    def is_ready(self, keys):
+        # This is to check if the assets have finished loading.
+        return all(key in ASSET_CACHE or (key in self.pending and self.pending[key].done()) for key in keys)
+
+    def progress(self):
+        # This is how much of the loading is done, from 0 to 1.
+        if not self.pending:
+            return 1.0
+        return sum(future.done() for future in self.pending.values()) / len(self.pending)
+
+
+# This is the loader of the game's assets.
+asset_loader = AssetLoader()
+
+
+def convert_surface(image, convert_mode):
+    # This is to convert the surface to the pixel format of the screen so blitting it is fast. It can only be done once
+    # the display has been created, so before that it will return the image as it is.
+    if pygame.display.get_surface() is None:
+        return image
+    if convert_mode == 'alpha':
+        return image.convert_alpha()
+    if convert_mode == 'opaque':
+        return image.convert()
+    return image
+
+
+def get_image(path, width=None, height=None, convert_mode='alpha'):
+    # This is to get an image from the asset cache. It will only load and scale the image from the disk the first time
+    # it is asked for and will return the same surface every time after that.
+    key = (path, width, height, convert_mode)
+    image = ASSET_CACHE.get(key)
+    if image is None:
+        loaded = asset_loader.take(key)
+        if loaded is None:
+            loaded = load_image(path, width, height)
+        image = convert_surface(loaded, convert_mode)
+        ASSET_CACHE[key] = image
+    return image
+
+
+def preload_image(path, width=None, height=None, convert_mode='alpha'):
+    # This is to start loading an image on the asset loader's threads, so get_image does not have to wait for the disk
+    # later.
+    asset_loader.submit((path, width, height, convert_mode), load_image, path, width, height)
+
+
+def get_scroller(path, vertical):
+    # This is to get the scrolling background of an image from the asset cache.
+    key = (path, 'scroller', vertical)
+    scroller = ASSET_CACHE.get(key)
+    if scroller is None:
+        scroller = BackgroundScroller(get_image(path, SCREEN_WIDTH, SCREEN_HEIGHT, 'opaque'), vertical)
+        ASSET_CACHE[key] = scroller
+    return scroller
+
+
+class SpriteAtlas:
+    WIDTH = 512
+
+    def __init__(self, sprites):
+        # This is one surface with all the gameplay sprites packed onto it, and the region of each sprite. The sprites
+        # are put in rows from the tallest to the shortest so there is not much empty space. With every sprite on the
+        # same surface the whole frame can be drawn with one call to Surface.blits.
+        self.regions = {}
+        x = y = row_height = 0
+        places = []
+        for key, sprite in sorted(sprites, key=lambda item: -item[1].get_height()):
+            width, height = sprite.get_size()
+            if x + width > self.WIDTH:
+                x, y = 0, y + row_height
+                row_height = 0
+            places.append((key, sprite, x, y))
+            self.regions[key] = pygame.Rect(x, y, width, height)
+            x += width
+            row_height = max(row_height, height)
+        self.surface = convert_surface(pygame.Surface((self.WIDTH, y + row_height), pygame.SRCALPHA), 'alpha')
+        self.surface.fill((0, 0, 0, 0))
+        for key, sprite, x, y in places:
+            # The sprites are copied with their exact colours and see-through parts instead of being blended.
+            self.surface.blit(sprite, (x, y), special_flags=pygame.BLEND_RGBA_MAX)
+
+
+class SpriteBatch:
+    def __init__(self, atlas):
+        # This is the list of sprites to draw in a frame. Each sprite is a region of the atlas at a position, and the
+        # whole list is drawn at once.
+        self.atlas = atlas
+        self.items = []
+        self.ammo_key = None
+        self.beam_key = None
+
+    def add(self, key, position):
+        # This is to add the sprite with the key to the frame at a position.
+        self.items.append((self.atlas.surface, position, self.atlas.regions[key]))
+
+    def draw(self, game_screen):
+        # This is to draw every sprite that was added and empty the list for the next frame. It returns how many
+        # sprites were drawn.
+        count = len(self.items)
+        game_screen.blits(self.items, False)
+        self.items.clear()
+        return count
+
+
+def get_atlas():
+    # This is to get the atlas of the gameplay sprites from the asset cache. It has the obstacles, the frames of the
+    # coin and the explosion, the skins, the ammo pickups and a beam in the colour of each ammo.
+    atlas = ASSET_CACHE.get('atlas')
+    if atlas is None:
+        sprites = [(('obstacle', i), get_image(path, OBSTACLE_WIDTH, OBSTACLE_HEIGHT))
+                   for i, path in enumerate(OBSTACLE_IMAGE_PATHS)]
+        sprites += [(('coin', i), frame) for i, frame in enumerate(Coin.load_frames())]
+        sprites += [(('explosion', i), frame) for i, frame in enumerate(Explosion.load_frames())]
+        for skin in profile.skins:
+            sprites.append((('skin', skin["image_path"]), get_image(skin["image_path"], PLAYER_WIDTH, PLAYER_HEIGHT)))
+        for ammo in profile.ammo_colours:
+            sprites.append((('ammo', ammo["image_path"]), get_image(ammo["image_path"], AMMO_WIDTH, AMMO_HEIGHT)))
+            beam = pygame.Surface((2, 20), pygame.SRCALPHA)
+            beam.fill(ammo["color"])
+            sprites.append((('beam', ammo["image_path"]), beam))
+        atlas = SpriteAtlas(sprites)
+        ASSET_CACHE['atlas'] = atlas
+    return atlas
+
+
+def get_sound(path):
+    # This is to get a sound effect from the asset cache, loading it the first time it is played.
+    key = (path, 'sound')
+    sound = ASSET_CACHE.get(key)
+    if sound is None:
+        sound = asset_loader.take(key)
+        if sound is None:
+            sound = pygame.mixer.Sound(path)
+        ASSET_CACHE[key] = sound
+    return sound
+
+
+def preload_sound(path):
+    # This is to start loading a sound effect on the asset loader's threads.
+    asset_loader.submit((path, 'sound'), pygame.mixer.Sound, path)
+
+
+def get_frames(path, columns, rows=1, width=None, height=None):
+    # This is to get the frames of a sprite sheet from the asset cache. The sheet is loaded once, scaled if a size is
+    # given and sliced into the columns and rows. The same list of frames is shared by every entity that uses it.
+    key = (path, width, height, 'frames', columns, rows)
+    frames = ASSET_CACHE.get(key)
+    if frames is None:
+        sprite_sheet = get_image(path, width, height)
+        sheet_width, sheet_height = sprite_sheet.get_size()
+        frame_width = sheet_width // columns
+        frame_height = sheet_height // rows
+        frames = [
+            sprite_sheet.subsurface(pygame.Rect(col * frame_width, row * frame_height, frame_width, frame_height))
+            for row in range(rows)
+            for col in range(columns)
+        ]
+        ASSET_CACHE[key] = frames
+    return frames
+
+
+class BackgroundScroller:
+    def __init__(self, image, vertical):
+        # This is a background that scrolls forever. The image is put twice, one after the other, onto one surface in
+        # the pixel format of the screen when the scroller is made. Any scroll position is then a window of the screen's
+        # size somewhere on that surface, so each frame is drawn with one blit of just that area instead of blitting the
+        # whole image twice.
+        width, height = image.get_size()
+        if vertical:
+            tiled = pygame.Surface((width, height * 2))
+            tiled.blit(image, (0, 0))
+            tiled.blit(image, (0, height))
+        else:
+            tiled = pygame.Surface((width * 2, height))
+            tiled.blit(image, (0, 0))
+            tiled.blit(image, (width, 0))
+        self.tiled = convert_surface(tiled, 'opaque')
+        self.vertical = vertical
+        self.length = height if vertical else width
+        self.area = pygame.Rect(0, 0, width, height)
+
+    def draw(self, game_screen, position):
+        # This is to draw the background scrolled to a position, which is how many pixels the image has moved left or
+        # up. The position can be between two pixels, it is rounded to the nearest one when drawing. It returns the
+        # pixel that was drawn so the caller can tell if the background moved on the screen.
+        start = round(position) % self.length
+        if self.vertical:
+            self.area.top = start
+        else:
+            self.area.left = start
+        game_screen.blit(self.tiled, (0, 0), self.area)
+        return start
+
+
+# This is the cache of rendered text. Turning text into a surface is slow, and the menus show the same titles, labels
+# and prices every frame, so each text is only rendered once and then reused. The key is the font, the text, the colour
+# and the antialias. When the cache is full the text that was used least recently is thrown away.
+TEXT_CACHE = collections.OrderedDict()
+TEXT_CACHE_SIZE = 256
+
+
+def render_text(font, text, colour, antialias=True):
+    # This is to get the surface of a text from the text cache, and to render it only if it is not in the cache yet.
+    key = (font, text, colour, antialias)
+    surface = TEXT_CACHE.get(key)
+    if surface is None:
+        surface = font.render(text, antialias, colour)
+        TEXT_CACHE[key] = surface
+        if len(TEXT_CACHE) > TEXT_CACHE_SIZE:
+            TEXT_CACHE.popitem(last=False)
+    else:
+        TEXT_CACHE.move_to_end(key)
+    return surface
+
+
+class AudioManager:
+    def __init__(self):
+        # This is to play the music and the sound effects. The music tracks are decoded once, like the sound effects,
+        # and played on two channels of their own so changing track fades the old one out while the new one fades in,
+        # without loading anything or waiting. Each sound effect has its own channels, so lots of lasers can not stop
+        # the coins or explosions being heard. When all the channels of an effect are busy the one that has been playing
+        # the longest is cut off for the new sound. It does nothing until it is started, so there is no sound in
+        # headless mode.
+        self.enabled = False
+        self.music_channels = []
+        self.music_index = 0
+        self.current_music = None
+        self.pending_music = None
+        self.effect_channels = {}
+        self.started_at = {}
+        self.missing = set()
+
+    def start(self):
+        # This is to reserve the channels for the music and the sound effects once the mixer is running.
+        self.enabled = pygame.mixer.get_init() is not None
+        if not self.enabled:
+            return
+        total = MUSIC_CHANNELS + sum(EFFECT_CHANNELS.values())
+        pygame.mixer.set_num_channels(total)
+        pygame.mixer.set_reserved(total)
+        self.music_channels = [pygame.mixer.Channel(i) for i in range(MUSIC_CHANNELS)]
+        first = MUSIC_CHANNELS
+        for path, count in EFFECT_CHANNELS.items():
+            self.effect_channels[path] = [pygame.mixer.Channel(first + i) for i in range(count)]
+            first += count
+
+    def load(self, path):
+        # This is to get a decoded sound from the asset cache. A file that is missing or can not be decoded is
+        # remembered and gives None, so the game carries on without that sound.
+        if path in self.missing:
+            return None
+        try:
+            return get_sound(path)
+        except (OSError, pygame.error):
+            self.missing.add(path)
+            return None
+
+    def play_music(self, path):
+        # This is to change the music. The new track starts as soon as it has been decoded.
+        if not self.enabled or path == self.current_music:
+            return
+        self.current_music = path
+        self.pending_music = path
+        self.update()
+
+    def update(self):
+        # This is called every frame. If a track is waiting to be played and it has finished decoding, it fades in
+        # while the track that was playing fades out.
+        if self.pending_music is None:
+            return
+        key = (self.pending_music, 'sound')
+        if key in asset_loader.pending and not asset_loader.is_ready([key]):
+            return
+        track = self.load(self.pending_music)
+        self.pending_music = None
+        self.music_channels[self.music_index].fadeout(MUSIC_FADE_MS)
+        self.music_index = (self.music_index + 1) % len(self.music_channels)
+        if track is not None:
+            self.music_channels[self.music_index].play(track, loops=-1, fade_ms=MUSIC_FADE_MS)
+
+    def play_effect(self, path):
+        # This is to play a sound effect on a free channel of its own, or on the one that started the longest time ago.
+        if not self.enabled:
+            return
+        sound = self.load(path)
+        if sound is None:
+            return
+        channels = self.effect_channels[path]
+        free = [channel for channel in channels if not channel.get_busy()]
+        channel = free[0] if free else min(channels, key=lambda busy: self.started_at.get(busy, 0.0))
+        channel.play(sound)
+        self.started_at[channel] = time.perf_counter()
+
+
 def play_music(music_path):
-    # This function was created to play the music for when the game is running
-    pygame.mixer.music.load(music_path)
-    pygame.mixer.music.play(loops=-1)
-
-
-def stop_music():
-    # This function was created to stop playing the music
-    pygame.mixer.music.stop()
-
-
-# These are the font styles that were used to give the future retro vibes.
-# This is where it was created, so it can be called later on in the code by the variable name.
-TITLE_FONT_STYLE = pygame.font.Font("fonts/Retro_font_One.otf", 50)
-SUBTITLE_FONT_STYLE = pygame.font.Font("fonts/Retro_font_Two.otf", 24)
-GAME_OVER_FONT_STYLE = pygame.font.Font("fonts/Retro_font_Two.otf", 100)
-NAV_BUTTON_FONT_STYLE = pygame.font.Font("fonts/Retro_font_Three.otf", 35)
-TEXT_SCORE_FONT_STYLE = pygame.font.Font("fonts/Retro_font_Two.otf", 20)
-HEADING_ONE_FONT_STYLE = pygame.font.Font("fonts/Retro_font_Four.otf", 15)
-STORY_FONT_STYLE = pygame.font.Font("fonts/Retro_font_Five.otf", 15)
-ITEM_BUTTON_FONT_STYLE = pygame.font.Font("fonts/Retro_font_Six.otf", 12)
-ITEM_NAME_FONT_STYLE = pygame.font.Font("fonts/Retro_font_Six.otf", 18)
-
-# These are the images that are loaded using the load_image function and the certain requirements.
-# It can be loaded here, so it can be called by the variable name in the code.
-gameplay_background_image = load_image('images/Background_1.png', SCREEN_WIDTH, SCREEN_HEIGHT)
-home_background_image = load_image('images/Background_2.png', SCREEN_WIDTH, SCREEN_HEIGHT)
-left_arrow_image = load_image('images/Left_Arrow.png', 50, 50)
-right_arrow_image = load_image('images/Right_Arrow.png', 50, 50)
-space_bar_image = load_image('images/Space_Bar.png', 50, 50)
-story_raccoon_image = load_image('images/Story_Raccoon.png', 300, 300)
-obstacle_one_image = load_image('images/Obstacle_1.png', OBSTACLE_WIDTH, OBSTACLE_HEIGHT)
-obstacle_two_image = load_image('images/Obstacle_2.png', OBSTACLE_WIDTH, OBSTACLE_HEIGHT)
-obstacle_three_image = load_image('images/Obstacle_3.png', OBSTACLE_WIDTH, OBSTACLE_HEIGHT)
-obstacle_four_image = load_image('images/Obstacle_4.png', OBSTACLE_WIDTH, OBSTACLE_HEIGHT)
-
-# This is where the sound effects and music is loaded. The sound effects uses mixer sound while the music is only
-# loaded from the file location as it is going to be used on a constant loop of playing the music.
-laser_sound = pygame.mixer.Sound('sounds/Laser_shoot_sound.wav')
-explosion_sound = pygame.mixer.Sound('sounds/Explosion_sound.wav')
-coin_sound = pygame.mixer.Sound('sounds/Coin_pickup_sound.wav')
-ammo_sound = pygame.mixer.Sound('sounds/Ammo_pickup_sound.flac')
+    # This function was created to play the music for when the game is running. It fades from the music that was
+    # playing.
+    audio_manager.play_music(music_path)
+
+
+def play_sound(path):
+    # This is to play a sound effect. There are no sounds in headless mode, so nothing is played then.
+    audio_manager.play_effect(path)
+
+
+# These are the images of the game. Each obstacle picks one of the obstacle images when it spawns.
+HOME_BACKGROUND_PATH = 'images/Background_2.png'
+GAMEPLAY_BACKGROUND_PATH = 'images/Background_1.png'
+OBSTACLE_IMAGE_PATHS = ['images/Obstacle_1.png', 'images/Obstacle_2.png', 'images/Obstacle_3.png', 'images/Obstacle_4.png']
+COIN_SPRITE_PATH = 'images/Coin_Sprite.png'
+EXPLOSION_SPRITE_PATH = 'images/Explosion_Sprite.png'
+COIN_FRAME_COUNT = 12  # There are 12 images in the coin sprite sheet.
+EXPLOSION_FRAME_COUNT = 14  # There are 7 columns and 2 rows in the explosion sprite sheet.
+# These are the images of the controls and story pages with their sizes.
+LEFT_ARROW_IMAGE = ('images/Left_Arrow.png', 50, 50)
+RIGHT_ARROW_IMAGE = ('images/Right_Arrow.png', 50, 50)
+SPACE_BAR_IMAGE = ('images/Space_Bar.png', 50, 50)
+STORY_RACCOON_IMAGE = ('images/Story_Raccoon.png', 300, 300)
+
+# These are the sound effects.
+LASER_SOUND = 'sounds/Laser_shoot_sound.wav'
+EXPLOSION_SOUND = 'sounds/Explosion_sound.wav'
+COIN_SOUND = 'sounds/Coin_pickup_sound.wav'
+AMMO_SOUND = 'sounds/Ammo_pickup_sound.flac'
+# These are how many channels each sound effect can play on at the same time.
+EFFECT_CHANNELS = {LASER_SOUND: 3, EXPLOSION_SOUND: 2, COIN_SOUND: 2, AMMO_SOUND: 1}
+
+# These are the music files. Each track is decoded once and then kept ready to play.
 GAME_OVER_MUSIC = 'sounds/Gameover_page_background.mp3'
 HOME_PAGE_MUSIC = 'sounds/Home_page_background.mp3'
 GAME_PLAY_MUSIC = 'sounds/Gameplay_page_background.mp3'
+MUSIC_CHANNELS = 2  # One channel fades out the old track while the other fades in the new one.
+MUSIC_FADE_MS = 800
+
+# The screen is only created when the game window is opened, and the sounds are only played then. In headless mode the
+# screen stays as None so the game logic can run without a screen or speakers.
+screen = None
+audio_manager = AudioManager()
+# These are how many seconds after the start the first frame and the home page were shown.
+STARTUP_TIMES = {}
+
+
+def draw_loading_screen(progress, font=None):
+    # This is the loading screen that is shown while the assets are loading. It shows a bar of how much is loaded,
+    # and the loading text once there is a font to write it with.
+    screen.fill((0, 0, 0))
+    if font is not None:
+        loading_text = render_text(font, "Loading...", (255, 255, 255))
+        screen.blit(loading_text, loading_text.get_rect(center=(SCREEN_WIDTH // 2, 360)))
+    pygame.draw.rect(screen, (255, 255, 255), pygame.Rect(100, 390, 400, 20), 2)
+    pygame.draw.rect(screen, (255, 255, 255), pygame.Rect(104, 394, int(392 * progress), 12))
+    pygame.display.flip()
+
+
+def game_images():
+    # This is the list of every image the game uses, with its size and convert mode. The home background is first as
+    # it is the only image the home page needs.
+    images = [(HOME_BACKGROUND_PATH, SCREEN_WIDTH, SCREEN_HEIGHT, 'opaque'),
+              (GAMEPLAY_BACKGROUND_PATH, SCREEN_WIDTH, SCREEN_HEIGHT, 'opaque')]
+    images += [(path, OBSTACLE_WIDTH, OBSTACLE_HEIGHT, 'alpha') for path in OBSTACLE_IMAGE_PATHS]
+    images.append((COIN_SPRITE_PATH, COIN_WIDTH, COIN_HEIGHT, 'alpha'))
+    images.append((EXPLOSION_SPRITE_PATH, None, None, 'alpha'))
+    for path, width, height in (LEFT_ARROW_IMAGE, RIGHT_ARROW_IMAGE, SPACE_BAR_IMAGE, STORY_RACCOON_IMAGE):
+        images.append((path, width, height, 'alpha'))
+    if profile is not None:
+        images += [(skin["image_path"], PLAYER_WIDTH, PLAYER_HEIGHT, 'alpha') for skin in profile.skins]
+        images += [(ammo["image_path"], AMMO_WIDTH, AMMO_HEIGHT, 'alpha') for ammo in profile.ammo_colours]
+    return images
+
+
+def bake_assets():
+    # This is to bake every image of the game ahead of time, so even the first start does not decode or scale them.
+    # It returns how many images there are.
+    images = game_images()
+    for path, width, height, _ in images:
+        load_image(path, width, height)
+    return len(images)
+
+
+def atlas_pixels():
+    # This is to build the atlas again from the images on the disk and get its pixels. The asset cache is put back
+    # afterwards, so the game keeps the atlas it already had.
+    saved_cache = dict(ASSET_CACHE)
+    ASSET_CACHE.clear()
+    try:
+        return pygame.image.tobytes(get_atlas().surface, 'RGBA')
+    finally:
+        ASSET_CACHE.clear()
+        ASSET_CACHE.update(saved_cache)
+
+
+def check_baked_atlas():
+    # This is to check that the atlas looks exactly the same on the first start, when every image is decoded, as on
+    # the starts after it, when the images come from the baked files. Both are made in a temporary folder so the real
+    # cache is not used. It needs the display, because the atlas is converted to the pixel format of the screen.
+    global BAKED_ASSET_FOLDER
+    folder = BAKED_ASSET_FOLDER
+    try:
+        with tempfile.TemporaryDirectory() as temporary_folder:
+            BAKED_ASSET_FOLDER = temporary_folder
+            cold = atlas_pixels()
+            warm = atlas_pixels()
+    finally:
+        BAKED_ASSET_FOLDER = folder
+    return cold == warm
+
+
+def preload_assets():
+    # This is to start loading everything the game needs on the asset loader's threads. The home page music goes first
+    # so it can start soon. The rest of the images and the sounds load while the user is on the home page.
+    if audio_manager.enabled:
+        preload_sound(HOME_PAGE_MUSIC)
+    for path, width, height, convert_mode in game_images():
+        preload_image(path, width, height, convert_mode)
+    if audio_manager.enabled:
+        for path in list(EFFECT_CHANNELS) + [GAME_PLAY_MUSIC, GAME_OVER_MUSIC]:
+            preload_sound(path)
+
+
+def finish_loading():
+    # This is to wait for every asset that is still loading and put it in the asset cache, so nothing has to be loaded
+    # in the middle of a game.
+    for key in list(asset_loader.pending):
+        if key[1] == 'sound':
+            audio_manager.load(key[0])
+        else:
+            get_image(*key)
+
+
+def init_window():
+    # This is to start pygame and open the game window. The window and a loading screen are shown first, then the
+    # fonts are loaded and the images and sounds start loading on other threads. It only waits until the home page can
+    # be drawn, the rest is loaded in the background or the first time it is used. It is not called in headless mode.
+    global TITLE_FONT_STYLE, SUBTITLE_FONT_STYLE, GAME_OVER_FONT_STYLE, NAV_BUTTON_FONT_STYLE, TEXT_SCORE_FONT_STYLE
+    global HEADING_ONE_FONT_STYLE, STORY_FONT_STYLE, ITEM_BUTTON_FONT_STYLE, ITEM_NAME_FONT_STYLE, screen
+    # This is to set the screen and title caption of the screen for the video game.
+    pygame.display.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("Raccoon Madness")
+    draw_loading_screen(0.0)
+    STARTUP_TIMES["first_frame"] = time.perf_counter() - PROCESS_START
+
+    pygame.init()
+    audio_manager.start()
+    asset_loader.start()
+    preload_assets()
+
+    # These are the font styles that were used to give the future retro vibes.
+    # This is where it was created, so it can be called later on in the code by the variable name.
+    TITLE_FONT_STYLE = pygame.font.Font("fonts/Retro_font_One.otf", 50)
+    SUBTITLE_FONT_STYLE = pygame.font.Font("fonts/Retro_font_Two.otf", 24)
+    GAME_OVER_FONT_STYLE = pygame.font.Font("fonts/Retro_font_Two.otf", 100)
+    NAV_BUTTON_FONT_STYLE = pygame.font.Font("fonts/Retro_font_Three.otf", 35)
+    TEXT_SCORE_FONT_STYLE = pygame.font.Font("fonts/Retro_font_Two.otf", 20)
+    HEADING_ONE_FONT_STYLE = pygame.font.Font("fonts/Retro_font_Four.otf", 15)
+    STORY_FONT_STYLE = pygame.font.Font("fonts/Retro_font_Five.otf", 15)
+    ITEM_BUTTON_FONT_STYLE = pygame.font.Font("fonts/Retro_font_Six.otf", 12)
+    ITEM_NAME_FONT_STYLE = pygame.font.Font("fonts/Retro_font_Six.otf", 18)
+
+    # This is to keep the loading screen up until the home background has loaded.
+    home_keys = [(HOME_BACKGROUND_PATH, SCREEN_WIDTH, SCREEN_HEIGHT, 'opaque')]
+    clock = pygame.time.Clock()
+    loading_font = pygame.font.Font(None, 40)
+    while not asset_loader.is_ready(home_keys):
+        pygame.event.pump()
+        draw_loading_screen(asset_loader.progress(), loading_font)
+        clock.tick(30)
+    get_scroller(HOME_BACKGROUND_PATH, vertical=False)
+
 
 # This is where the difficulty for the game is set incase the player wants a bit more of a challenge. It is where the
 # amount of ammo you start with and the speed of the game.
@@ -84,81 +648,208 @@ DIFFICULTY_SETTINGS = {
 
 # This is to load the high score file, so it can be displayed on the home page to see the highest score currently.
 HIGHEST_SCORE_FILE = 'highest_score.txt'
+GAME_DATA_FILE = 'game_data.json'
+# This is how many seconds the profile saver waits after a change before writing it, so changes close together like
+# picking up several coins are written to the disk as a single save.
+SAVE_INTERVAL = 2.0
 
-# This is to set the screen and title caption of the screen for the video game.
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Raccoon Madness")
 
+# This is the umask of the process. It can only be read by setting it, so it is read once when the game starts, before
+# the profile saver's thread could be writing a file.
+FILE_UMASK = os.umask(0)
+os.umask(FILE_UMASK)
 
-def load_skins():
-    # This function is used to load the skins. It is used for the item shop incase the user wants to purchase a skin and
-    # equip it. It will remember which one is currently purchased or which is equipped.
+
+def write_file_atomic(path, text):
+    # This is to write a file safely. The text is written to a temporary file in the same folder first and then it
+    # replaces the real file in one step, so if the game crashes while saving the old file is still complete. The text
+    # can also be bytes. The temporary file can only be read by its owner, so it is given the permissions of the file it
+    # replaces, or the usual permissions of a new file, before it takes its place.
+    folder = os.path.dirname(os.path.abspath(path))
+    mode = 'wb' if isinstance(text, bytes) else 'w'
     try:
-        # it will try open the file if it exists. It will then load all the data inside the file.
-        with open('game_data.json', 'r') as f:
-            data = json.load(f)
-            return data["skins"], data["ammo_colours"], data["player_coins"]
+        permissions = os.stat(path).st_mode & 0o7777
     except FileNotFoundError:
-        # If the file was not found, or it was deleted, it will create another one with it being set to the default.
-        raccoon_skins = [
-            {"name": "Nymphia", "image_path": 'images/Raccoon_1.png', "equipped": True, "purchased": True, "price": 0},
-            {"name": "Bianca", "image_path": 'images/Raccoon_2.png', "equipped": False, "purchased": False, "price": 50},
-            {"name": "Dawn", "image_path": 'images/Raccoon_3.png', "equipped": False, "purchased": False, "price": 100},
-            {"name": "Amanda", "image_path": 'images/Raccoon_4.png', "equipped": False, "purchased": False, "price": 150},
-            {"name": "Willow", "image_path": 'images/Raccoon_5.png', "equipped": False, "purchased": False, "price": 200},
-            {"name": "Trixie", "image_path": 'images/Raccoon_6.png', "equipped": False, "purchased": False, "price": 250},
-        ]
-        ammo_colours = [
-            {"name": "Pink", "image_path": 'images/Ammo_1.png', "color": (222, 57, 232), "equipped": True, "purchased": True, "price": 0},
-            {"name": "Red", "image_path": 'images/Ammo_2.png', "color": (241, 36, 14), "equipped": False, "purchased": False, "price": 25},
-            {"name": "Blue", "image_path": 'images/Ammo_3.png', "color": (24, 203, 231), "equipped": False, "purchased": False, "price": 50},
-            {"name": "Orange", "image_path": 'images/Ammo_4.png', "color": (255, 127, 0), "equipped": False, "purchased": False, "price": 75},
-            {"name": "Yellow", "image_path": 'images/Ammo_5.png', "color": (227, 243, 19), "equipped": False, "purchased": False, "price": 100},
-            {"name": "Green", "image_path": 'images/Ammo_6.png', "color": (20, 235, 86), "equipped": False, "purchased": False, "price": 125},
-        ]
-        default_player_coins = 0
-        # After setting the default amounts and variables, it will create the new JSON file for the user.
-        with open('game_data.json', 'w') as f:
-            json.dump({
-                "skins": raccoon_skins,
-                "ammo_colours": ammo_colours,
-                "player_coins": default_player_coins
-            }, f, indent=4)
-        return raccoon_skins, ammo_colours, default_player_coins
-
-
-def load_highest_score():
-    # This is to load the highest score in the file. If the file does not exist, it will set the value to zero.
-    # The file will get created when the user plays and will create one when there is a highscore to be saved.
-    if os.path.exists(HIGHEST_SCORE_FILE):
-        with open(HIGHEST_SCORE_FILE, "r") as file:
+        permissions = 0o666 & ~FILE_UMASK
+    with tempfile.NamedTemporaryFile(mode, dir=folder, prefix='.tmp_', delete=False) as f:
+        try:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+            os.chmod(f.name, permissions)
+        except OSError:
+            # If the temporary file could not be written, it is removed and the real file is left as it was.
+            f.close()
+            os.remove(f.name)
+            raise
+    os.replace(f.name, path)
+
+
+class ProfileSaver:
+    def __init__(self, data_file=GAME_DATA_FILE, score_file=HIGHEST_SCORE_FILE, interval=SAVE_INTERVAL):
+        # This is to save the player profile in the background. Changes only mark the profile as dirty and the saver
+        # writes them later on its own thread or when flush is called at a safe point like game over or quitting.
+        self.data_file = data_file
+        self.score_file = score_file
+        self.interval = interval
+        self.profile = None
+        self.write_lock = threading.Lock()
+        self.dirty = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.written_data = None
+        self.written_score = None
+
+    def load_skins(self):
+        # This function is used to load the skins. It is used for the item shop incase the user wants to purchase a skin
+        # and equip it. It will remember which one is currently purchased or which is equipped.
+        try:
+            # it will try open the file if it exists. It will then load all the data inside the file.
+            with open(self.data_file, 'r') as f:
+                data = json.load(f)
+                return data["skins"], data["ammo_colours"], data["player_coins"]
+        except FileNotFoundError:
+            # If the file was not found, or it was deleted, it will create another one with it being set to the default.
+            raccoon_skins = [
+                {"name": "Nymphia", "image_path": 'images/Raccoon_1.png', "equipped": True, "purchased": True, "price": 0},
+                {"name": "Bianca", "image_path": 'images/Raccoon_2.png', "equipped": False, "purchased": False, "price": 50},
+                {"name": "Dawn", "image_path": 'images/Raccoon_3.png', "equipped": False, "purchased": False, "price": 100},
+                {"name": "Amanda", "image_path": 'images/Raccoon_4.png', "equipped": False, "purchased": False, "price": 150},
+                {"name": "Willow", "image_path": 'images/Raccoon_5.png', "equipped": False, "purchased": False, "price": 200},
+                {"name": "Trixie", "image_path": 'images/Raccoon_6.png', "equipped": False, "purchased": False, "price": 250},
+            ]
+            ammo_colours = [
+                {"name": "Pink", "image_path": 'images/Ammo_1.png', "color": (222, 57, 232), "equipped": True, "purchased": True, "price": 0},
+                {"name": "Red", "image_path": 'images/Ammo_2.png', "color": (241, 36, 14), "equipped": False, "purchased": False, "price": 25},
+                {"name": "Blue", "image_path": 'images/Ammo_3.png', "color": (24, 203, 231), "equipped": False, "purchased": False, "price": 50},
+                {"name": "Orange", "image_path": 'images/Ammo_4.png', "color": (255, 127, 0), "equipped": False, "purchased": False, "price": 75},
+                {"name": "Yellow", "image_path": 'images/Ammo_5.png', "color": (227, 243, 19), "equipped": False, "purchased": False, "price": 100},
+                {"name": "Green", "image_path": 'images/Ammo_6.png', "color": (20, 235, 86), "equipped": False, "purchased": False, "price": 125},
+            ]
+            default_player_coins = 0
+            # After setting the default amounts and variables, it will create the new JSON file for the user.
+            write_file_atomic(self.data_file, self.format_data(raccoon_skins, ammo_colours, default_player_coins))
+            return raccoon_skins, ammo_colours, default_player_coins
+
+    def load_highest_score(self):
+        # This is to load the highest score in the file. If the file does not exist, it will set the value to zero.
+        # The file will get created when the user plays and will create one when there is a highscore to be saved.
+        if os.path.exists(self.score_file):
+            with open(self.score_file, "r") as file:
+                try:
+                    return int(file.read().strip())
+                except ValueError:
+                    return 0
+        return 0
+
+    def load(self):
+        # This is to load the player profile from the disk. It is only called once when the game starts and the saver
+        # remembers what is on the disk so it only writes the files that actually changed.
+        skins, ammo_colours, coins = self.load_skins()
+        highest_score = self.load_highest_score()
+        self.profile = PlayerProfile(skins, ammo_colours, coins, highest_score)
+        self.written_data = self.format_data(skins, ammo_colours, coins)
+        self.written_score = str(highest_score)
+        return self.profile
+
+    @staticmethod
+    def format_data(skins, ammo_colours, coins):
+        # This is to turn the skins, ammo colours and coins into the text that is saved in the JSON file.
+        return json.dumps({
+            "skins": skins,
+            "ammo_colours": ammo_colours,
+            "player_coins": coins
+        }, indent=4)
+
+    def mark_dirty(self):
+        # This is called when the profile changes. It does not write anything, it only wakes up the saver thread.
+        self.dirty.set()
+
+    def flush(self):
+        # This is to write the profile to the disk if it changed since the last save. The JSON file holds the skins,
+        # ammo colours and coins and the high score file holds the highest score.
+        with self.write_lock:
+            self.dirty.clear()
+            with self.profile.lock:
+                data = self.format_data(self.profile.skins, self.profile.ammo_colours, self.profile.coins)
+                score = str(self.profile.highest_score)
+            if data != self.written_data:
+                write_file_atomic(self.data_file, data)
+                self.written_data = data
+            if score != self.written_score:
+                write_file_atomic(self.score_file, score)
+                self.written_score = score
+
+    def run(self):
+        # This is the loop of the saver thread. It waits until the profile is dirty, then waits a little longer so more
+        # changes can be saved together, and then writes the profile.
+        while not self.stopping.is_set():
+            self.dirty.wait()
+            self.stopping.wait(self.interval)
             try:
-                return int(file.read().strip())
-            except ValueError:
-                return 0
-    return 0
-
-
-def save_skins(skin, ammo_colour, player_coin):
-    # This is used to save the changes made in the item shop. If the user purchased a new skin, it will update here.
-    # If the user selected a skin to equip, it will be loaded and saved here to make sure these changes are saved.
-    with open('game_data.json', 'w') as f:
-        data = {
-            "skins": skin,
-            "ammo_colours": ammo_colour,
-            "player_coins": player_coin
-        }
-        json.dump(data, f, indent=4)
+                self.flush()
+            except OSError:
+                # If the save failed, it will try again the next time the profile changes.
+                pass
+
+    def start(self):
+        # This is to start the saver thread. It is a daemon thread so it never keeps the game open on its own.
+        self.thread = threading.Thread(target=self.run, name="ProfileSaver", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # This is to stop the saver thread and write anything that has not been saved yet. It is called when the game
+        # is closed.
+        self.stopping.set()
+        self.dirty.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+
+class PlayerProfile:
+    def __init__(self, skins, ammo_colours, coins, highest_score):
+        # This is to keep the player's saved data in memory so the pages and the game do not need to read the files
+        # on every frame. It holds the skins, ammo colours, coins and the highest score. The lock is held while it is
+        # changed so the saver thread never writes a half changed profile.
+        self.lock = threading.Lock()
+        self.skins = skins
+        self.ammo_colours = ammo_colours
+        self.coins = coins
+        self.highest_score = highest_score
+
+    def equipped_skin(self):
+        # This is to get the skin the player currently has equipped.
+        for skin in self.skins:
+            if skin["equipped"]:
+                return skin
+        return self.skins[0]
+
+    def equipped_ammo(self):
+        # This is to get the ammo colour the player currently has equipped.
+        for ammo in self.ammo_colours:
+            if ammo["equipped"]:
+                return ammo
+        return self.ammo_colours[0]
 
+    def add_coins(self, amount):
+        # This is to add the coins the player collected to the total amount of coins.
+        with self.lock:
+            self.coins += amount
 
-def save_highest_score(highest_score):
-    # This is to create the high score in the text file. This function is only called when the high score is higher in
-    # the text file.
-    with open(HIGHEST_SCORE_FILE, "w") as file:
-        file.write(str(highest_score))
+    def record_score(self, score):
+        # This is to update the highest score if the new score is higher. It returns True when it is a new high score.
+        with self.lock:
+            if score > self.highest_score:
+                self.highest_score = score
+                return True
+        return False
 
 
-skins, ammo_colors, player_coins = load_skins()
+# The profile and its saver are created in main when the game window is opened. Headless games do not touch them.
+profile_saver = None
+profile = None
 
 
 class Player:
@@ -184,133 +875,287 @@ class Player:
 
     def collect_ammo(self):
         # This is when ammo is collected it will play the sound effect and increase the player's ammo count by one.
-        ammo_sound.play()
+        play_sound(AMMO_SOUND)
         self.ammo += 1
 
     def collect_coin(self):
         # This is when coins are collected it will play the sound effect and increase the player's collected coins by one.
-        coin_sound.play()
+        play_sound(COIN_SOUND)
         self.collected_coins += 1
-        self.save_total_coins()
 
-    def save_total_coins(self):
-        # This is to save the total number of coins collected to the JSON file for persistence.
-        try:
-            with open('game_data.json', 'r') as f:
-                data = json.load(f)
-            # Update the total coin count with the newly collected coins.
-            data["player_coins"] += self.collected_coins
-            self.collected_coins = 0  # Reset the temporary coin count after saving.
-            # Write the updated data back to the JSON file.
-            with open('game_data.json', 'w') as f:
-                json.dump(data, f, indent=4)
-        except FileNotFoundError:
-            # This is to call the initial file if the file does not exist.
-            load_skins()
+
+class EntityPool:
+    def __init__(self, entity_class):
+        # This is a pool for one type of entity. The entities on the screen are kept in the active list and the ones
+        # that were removed are kept in the free list, so they can be reused instead of creating new objects and rects
+        # every time something spawns.
+        self.entity_class = entity_class
+        self.active = []
+        self.free = []
+
+    def acquire(self, *args):
+        # This is to get an entity from the pool. It reuses a free entity if there is one and resets it with the given
+        # values, otherwise it creates a new one. Each entity remembers its slot in the active list.
+        if self.free:
+            entity = self.free.pop()
+            entity.reset(*args)
+        else:
+            entity = self.entity_class(*args)
+        entity.slot = len(self.active)
+        self.active.append(entity)
+        return entity
+
+    def release(self, entity):
+        # This is to give an entity back to the pool. The last entity in the active list is moved into its slot, so it
+        # does not need to shift the whole list like list.remove does. Loops that release entities go through the
+        # active list backwards so the moved entity has always been handled already.
+        last = self.active.pop()
+        if last is not entity:
+            self.active[entity.slot] = last
+            last.slot = entity.slot
+        entity.slot = -1
+        self.free.append(entity)
+
+    def release_all(self):
+        # This is to give every active entity back to the pool when a new game starts.
+        for entity in self.active:
+            entity.slot = -1
+        self.free.extend(self.active)
+        self.active.clear()
+
+    def __len__(self):
+        return len(self.active)
+
+
+class LaneIndex:
+    def __init__(self, pool):
+        # This is the collision index for the entities of one pool. The screen is split into the five lane columns and
+        # each column keeps its entities sorted from the top of the screen to the bottom, so a collision check only
+        # looks at the entities in the same lane and close to the same height instead of every entity.
+        self.pool = pool
+        self.lanes = [[] for _ in range(LANE_COUNT)]
+        self.tops = [[] for _ in range(LANE_COUNT)]
+        self.tallest = 0
+        self.stale = True
+
+    def invalidate(self):
+        # This is called when the entities moved or a new one spawned, so the index is rebuilt the next time it is used.
+        self.stale = True
+
+    @staticmethod
+    def lane_range(rect):
+        # This is to work out which lane columns a rect covers. Most entities are inside one lane, but the coin rect
+        # is wider than a lane so it is added to every lane it covers.
+        first = max(0, rect.left // LANE_WIDTH)
+        last = min(LANE_COUNT - 1, (rect.right - 1) // LANE_WIDTH)
+        return range(first, last + 1)
+
+    def rebuild(self):
+        # This is to put every active entity into the lanes it covers and sort each lane by the top of the rects.
+        # The entities keep nearly the same order every frame, so sorting an almost sorted lane is quick.
+        for lane in self.lanes:
+            lane.clear()
+        tallest = 0
+        for entity in self.pool.active:
+            rect = entity.rect
+            if rect.height > tallest:
+                tallest = rect.height
+            for lane in self.lane_range(rect):
+                self.lanes[lane].append(entity)
+        for lane, entities in enumerate(self.lanes):
+            entities.sort(key=lambda entity: entity.rect.y)
+            self.tops[lane] = [entity.rect.y for entity in entities]
+        self.tallest = tallest
+        self.stale = False
+
+    def query(self, rect):
+        # This is to get the active entities that collide with the rect. It uses a binary search in each lane the rect
+        # covers to only check the entities that could reach the rect. Entities that were given back to the pool since
+        # the last rebuild have a slot of -1 and are skipped.
+        if self.stale:
+            self.rebuild()
+        lanes = self.lane_range(rect)
+        hits = []
+        for lane in lanes:
+            entities = self.lanes[lane]
+            tops = self.tops[lane]
+            start = bisect.bisect_right(tops, rect.top - self.tallest)
+            end = bisect.bisect_left(tops, rect.bottom)
+            for i in range(start, end):
+                entity = entities[i]
+                if entity.slot != -1 and entity.rect.colliderect(rect):
+                    if len(lanes) == 1 or entity not in hits:
+                        hits.append(entity)
+        return hits
+
+    def lowest_top(self, lane, below):
+        # This is to get the top of the lowest active entity in the lane whose top is above the given height, or None
+        # if there is no entity there.
+        if self.stale:
+            self.rebuild()
+        entities = self.lanes[lane]
+        i = bisect.bisect_left(self.tops[lane], below) - 1
+        while i >= 0:
+            if entities[i].slot != -1:
+                return entities[i].rect.y
+            i -= 1
+        return None
 
 
 class Coin:
+    __slots__ = ('lane', 'rect', 'prev_y', 'speed', 'current_frame', 'frame_delay', 'frame_counter', 'slot')
+
     def __init__(self, lane):
-        # This is to initialize the coin's animation frames, position, and movement speed.
-        self.frames = None
+        # This is to initialize the coin's rect. The rest is set in reset so the coin can be reused by the pool.
+        self.rect = pygame.Rect(0, 0, COIN_WIDTH, COIN_HEIGHT)
+        self.slot = -1
+        self.reset(lane)
+
+    def reset(self, lane):
+        # This is to set the coin's position, movement speed and animation back to the start of the lane.
         self.lane = lane
-        self.rect = pygame.Rect(LANE_POSITIONS[lane], -COIN_HEIGHT, COIN_WIDTH, COIN_HEIGHT)
+        self.rect.topleft = (LANE_POSITIONS[lane], -COIN_HEIGHT)
+        self.prev_y = self.rect.y
         self.speed = 5
-        self.load_frames()
         self.current_frame = 0
         self.frame_delay = 5  # Number of update cycles between each frame switch.
         self.frame_counter = 0  # Counter to keep track of the delay between frame changes.
 
-    def load_frames(self):
-        # This is to load the coin sprite sheet and scale it to the desired size of the coin width and height.
-        sprite_sheet = pygame.image.load("images/Coin_Sprite.png").convert_alpha()
-        sprite_sheet = pygame.transform.scale(sprite_sheet, (COIN_WIDTH, COIN_HEIGHT))
-        # This is to calculate the width of each individual frame in the sprite sheet. There are 12 images in the coin
-        # sprite sheet.
-        frame_width = COIN_WIDTH // 12
-        # This is to extract each frame from the sprite sheet and store it in the frames list.
-        self.frames = [
-            sprite_sheet.subsurface(pygame.Rect(i * frame_width, 0, frame_width, COIN_HEIGHT))
-            for i in range(12)
-        ]
+    @staticmethod
+    def array_values(lane):
+        # This is the position, lane and first frame of a new coin in the NumPy engine.
+        return LANE_POSITIONS[lane], -COIN_HEIGHT, lane, 0
+
+    @staticmethod
+    def load_frames():
+        # This is to get the coin frames from the asset cache. The sprite sheet is scaled to the coin width and height
+        # and every coin shares the same list of frames. They are only needed when the coin is drawn.
+        return get_frames(COIN_SPRITE_PATH, COIN_FRAME_COUNT, 1, COIN_WIDTH, COIN_HEIGHT)
 
     def update(self):
-        # This is to update the coin's position by moving it down the screen.
+        # This is to update the coin's position by moving it down the screen. The position before the move is kept so
+        # the coin can be drawn between the two positions.
+        self.prev_y = self.rect.y
         self.rect.y += self.speed
         # Increment the frame counter, and switch to the next frame if the delay has passed.
         self.frame_counter += 1
         if self.frame_counter >= self.frame_delay:
             self.frame_counter = 0  # Reset the frame counter.
             # This will move to the next frame, looping back to the first frame if at the end.
-            self.current_frame = (self.current_frame + 1) % len(self.frames)
+            self.current_frame = (self.current_frame + 1) % COIN_FRAME_COUNT
 
     def is_off_screen(self):
         # This is to check if the coin has moved below the bottom of the screen.
         return self.rect.y > SCREEN_HEIGHT
 
-    def draw(self, game_screen):
-        # This is to draw the current frame of the coin at its current position on the screen.
-        game_screen.blit(self.frames[self.current_frame], self.rect.topleft)
+    def add_to_batch(self, batch, alpha=1.0):
+        # This is to add the current frame of the coin to the sprites of the frame. Alpha is how far the game is between
+        # the last tick and the next one, so the coin moves smoothly even when the screen is drawn faster than the game
+        # ticks.
+        y = self.prev_y + (self.rect.y - self.prev_y) * alpha
+        batch.add(('coin', self.current_frame), (self.rect.x, y))
 
 
 class Obstacle:
-    def __init__(self, lane):
-        # This is to initialize the obstacle's position, image, and speed.
+    __slots__ = ('lane', 'rect', 'prev_y', 'variant', 'speed', 'slot')
+
+    def __init__(self, lane, variant=0):
+        # This is to initialize the obstacle's rect. The rest is set in reset so the obstacle can be reused by the pool.
+        self.rect = pygame.Rect(0, 0, OBSTACLE_WIDTH, OBSTACLE_HEIGHT)
+        self.slot = -1
+        self.reset(lane, variant)
+
+    def reset(self, lane, variant=0):
+        # This is to set the obstacle's position, image, and speed. The variant is which of the obstacle images it uses.
         self.lane = lane
-        self.rect = pygame.Rect(LANE_POSITIONS[lane], -OBSTACLE_HEIGHT, OBSTACLE_WIDTH, OBSTACLE_HEIGHT)
-        self.image = random.choice([obstacle_one_image, obstacle_two_image, obstacle_three_image, obstacle_four_image])
+        self.rect.topleft = (LANE_POSITIONS[lane], -OBSTACLE_HEIGHT)
+        self.prev_y = self.rect.y
+        self.variant = variant
         self.speed = 0
 
+    @staticmethod
+    def array_values(lane, variant=0):
+        # This is the position, lane and image of a new obstacle in the NumPy engine.
+        return LANE_POSITIONS[lane], -OBSTACLE_HEIGHT, lane, variant
+
     def update(self):
         # This is to update the obstacle's position by moving it down the screen based on its speed.
+        self.prev_y = self.rect.y
         self.rect.y += self.speed
 
     def is_off_screen(self):
         # This is to check if the obstacle has moved below the bottom of the screen.
         return self.rect.y > SCREEN_HEIGHT
 
-    def draw(self, game_screen):
-        # This is to draw the obstacle's image at its current position on the screen.
-        game_screen.blit(self.image, self.rect.topleft)
+    def add_to_batch(self, batch, alpha=1.0):
+        # This is to add the obstacle's image to the sprites of the frame between its last and current position.
+        y = self.prev_y + (self.rect.y - self.prev_y) * alpha
+        batch.add(('obstacle', self.variant), (self.rect.x, y))
 
 
 class AmmoPickup:
+    __slots__ = ('lane', 'rect', 'prev_y', 'speed', 'slot')
+
     def __init__(self, lane):
-        # This is to initialize the ammo pickup's lane, position, and speed.
+        # This is to initialize the ammo pickup's rect. The rest is set in reset so it can be reused by the pool.
+        self.rect = pygame.Rect(0, 0, AMMO_WIDTH, AMMO_HEIGHT)
+        self.slot = -1
+        self.reset(lane)
+
+    def reset(self, lane):
+        # This is to set the ammo pickup's lane, position, and speed.
         self.lane = lane
-        self.rect = pygame.Rect(LANE_POSITIONS[lane], -AMMO_HEIGHT, AMMO_WIDTH, AMMO_HEIGHT)
+        self.rect.topleft = (LANE_POSITIONS[lane], -AMMO_HEIGHT)
+        self.prev_y = self.rect.y
         self.speed = 0
 
+    @staticmethod
+    def array_values(lane):
+        # This is the position and lane of a new ammo pickup in the NumPy engine.
+        return LANE_POSITIONS[lane], -AMMO_HEIGHT, lane, 0
+
     def update(self):
         # This is to update the ammo pickup's position by moving it down the screen based on its speed.
+        self.prev_y = self.rect.y
         self.rect.y += self.speed
 
     def is_off_screen(self):
         # This is to check if the ammo pickup has moved below the bottom of the screen.
         return self.rect.y > SCREEN_HEIGHT
 
-    def draw(self, game_screen):
-        # This will draw the equipped ammo image at the ammo pickup's current position on the screen.
-        for ammo in ammo_colors:
-            if ammo["equipped"]:
-                # This will load the equipped ammo image and resize it to fit the ammo pickup dimensions.
-                equipped_image = pygame.image.load(ammo["image_path"])
-                equipped_image = pygame.transform.scale(equipped_image, (AMMO_WIDTH, AMMO_HEIGHT))
-                # This will display the equipped ammo image at the ammo pickup's position.
-                game_screen.blit(equipped_image, self.rect.topleft)
-                break
+    def add_to_batch(self, batch, alpha=1.0):
+        # This will add the equipped ammo image to the sprites of the frame between the ammo pickup's last and current
+        # position.
+        y = self.prev_y + (self.rect.y - self.prev_y) * alpha
+        batch.add(batch.ammo_key, (self.rect.x, y))
 
 
 class Bullet:
+    __slots__ = ('left_beam', 'right_beam', 'prev_y', 'speed', 'slot')
+
     def __init__(self, x, y):
         # This is to initialize two beams for the bullet: one on the left and one on the right.
+        self.left_beam = pygame.Rect(0, 0, 2, 20)
+        self.right_beam = pygame.Rect(0, 0, 2, 20)
+        self.slot = -1
+        self.reset(x, y)
+
+    def reset(self, x, y):
         # The x and y parameters determine the starting position of the bullet beams.
-        self.left_beam = pygame.Rect(x - 15, y, 2, 20)
-        self.right_beam = pygame.Rect(x + 15, y, 2, 20)
+        self.left_beam.topleft = (x - 15, y)
+        self.right_beam.topleft = (x + 15, y)
+        self.prev_y = y
         self.speed = 10
 
+    @staticmethod
+    def array_values(x, y):
+        # This is the position of the left beam of a new bullet in the NumPy engine. The right beam is always 30 pixels
+        # to the right of it.
+        return x - 15, y, 0, 0
+
     def update(self):
         # This will update the position of both beams by moving them upward based on the bullet's speed.
+        self.prev_y = self.left_beam.y
         self.left_beam.y -= self.speed
         self.right_beam.y -= self.speed
 
@@ -318,59 +1163,1242 @@ class Bullet:
         # This will check if both beams have moved off the top of the screen.
         return self.left_beam.y < 0 and self.right_beam.y < 0
 
-    def draw(self, game_screen):
-        # This will draw each beam in the color of the currently equipped ammo.
-        for ammo in ammo_colors:
-            if ammo["equipped"]:
-                # This will get the color of the equipped ammo and draw both beams with that color.
-                ammo_color = ammo["color"]
-                pygame.draw.rect(game_screen, ammo_color, self.left_beam)
-                pygame.draw.rect(game_screen, ammo_color, self.right_beam)
-                break
+    def add_to_batch(self, batch, alpha=1.0):
+        # This will add each beam in the color of the currently equipped ammo to the sprites of the frame between their
+        # last and current position.
+        y = round(self.prev_y + (self.left_beam.y - self.prev_y) * alpha)
+        batch.add(batch.beam_key, (self.left_beam.x, y))
+        batch.add(batch.beam_key, (self.right_beam.x, y))
 
 
 class Explosion:
+    __slots__ = ('current_frame', 'rect', 'active', 'slot')
+
     def __init__(self, x, y):
-        # This is to initialize the explosion with position, frames for animation, and active status.
-        self.frames = []
-        self.load_frames()
+        # This is to initialize the explosion with its rect. The rest is set in reset so it can be reused by the pool.
+        self.rect = pygame.Rect(0, 0, 50, 50)
+        self.slot = -1
+        self.reset(x, y)
+
+    def reset(self, x, y):
+        # This is to set the explosion's position and start the animation again with the active status.
         self.current_frame = 0
-        self.rect = pygame.Rect(x, y, 50, 50)
+        self.rect.topleft = (x, y)
         self.active = True
 
-    def load_frames(self):
-        # This is to load the explosion frames from the sprite sheet.
-        sprite_sheet = pygame.image.load("images/Explosion_Sprite.png").convert_alpha()
-        sheet_width, sheet_height = sprite_sheet.get_size()
-
-        # This will calculate the dimensions of each frame.
-        frame_width = sheet_width // 7  # 7 columns in the sprite sheet.
-        frame_height = sheet_height // 2  # 2 rows in the sprite sheet.
+    @staticmethod
+    def array_values(x, y):
+        # This is the position and first frame of a new explosion in the NumPy engine.
+        return x, y, 0, 0
 
-        # This will then loop through the rows and the columns to extract each frame from the sprite sheet.
-        for row in range(2):
-            for col in range(7):
-                frame = sprite_sheet.subsurface(
-                    pygame.Rect(col * frame_width, row * frame_height, frame_width, frame_height)
-                )
-                self.frames.append(frame)  # Add each frame to the frames list.
+    @staticmethod
+    def load_frames():
+        # This is to get the explosion frames from the asset cache. The sprite sheet has 7 columns and 2 rows and every
+        # explosion shares the same list of frames. They are only needed when the explosion is drawn.
+        return get_frames(EXPLOSION_SPRITE_PATH, 7, 2)
 
     def update(self):
         # This will then update the current frame of the explosion.
-        if self.current_frame < len(self.frames) - 1:
+        if self.current_frame < EXPLOSION_FRAME_COUNT - 1:
             # It will move to the next frame if not at the end of the animation.
             self.current_frame += 1
         else:
             # If the last frame has been displayed, deactivate the explosion.
             self.active = False
 
-    def draw(self, game_screen):
-        # This will draw the current frame of the explosion if it is active.
+    def add_to_batch(self, batch, alpha=1.0):
+        # This will add the current frame of the explosion to the sprites of the frame if it is active. Explosions do
+        # not move so alpha is not used.
         if self.active:
-            game_screen.blit(self.frames[self.current_frame], self.rect.topleft)
+            batch.add(('explosion', self.current_frame), self.rect.topleft)
+
+
+# These are the phases of a frame and the counters that the frame profiler shows and writes to its log.
+PROFILER_PHASES = ['idle', 'events', 'input', 'spawn', 'update', 'collision', 'draw', 'flip']
+PROFILER_COUNTERS = ['entities', 'blits', 'disk_loads']
+PROFILER_KEY = pygame.K_F3  # This is the key that shows and hides the performance overlay.
+
+
+class FrameProfiler:
+    def __init__(self, enabled=True, history=60):
+        # This is to time the phases of each frame, like spawning, updating and drawing, and to count things that
+        # happen in the frame, like blits and images loaded from the disk. The time of each phase is added up until the
+        # frame ends, so a frame that runs several ticks counts all of them. When it is not enabled the calls return
+        # straight away so the game can always call it. The last frames are kept for the overlay, and every frame can
+        # also be written to a CSV or JSONL log file.
+        self.enabled = enabled
+        self.phase_times = {}
+        self.counters = {}
+        self.phase = None
+        self.phase_start = 0.0
+        self.history = collections.deque(maxlen=history)
+        self.frame_number = 0
+        self.log_file = None
+        self.log_writer = None
+        self.overlay_font = None
+
+    def begin(self, phase):
+        # This is to start timing a phase.
+        if self.enabled:
+            self.phase = phase
+            self.phase_start = time.perf_counter()
+
+    def end(self):
+        # This is to stop timing the current phase and add its time to the frame.
+        if self.enabled:
+            elapsed = time.perf_counter() - self.phase_start
+            self.phase_times[self.phase] = self.phase_times.get(self.phase, 0.0) + elapsed
+
+    def count(self, counter, amount=1):
+        # This is to add to one of the counters of the frame.
+        if self.enabled:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def end_frame(self, state=None):
+        # This is to finish the frame. It returns the frame's sample with the seconds spent in each phase and the
+        # counters, keeps it for the overlay, writes it to the log and starts a new frame.
+        sample = {"frame": self.frame_number, "state": state, "phases": self.phase_times, "counters": self.counters}
+        self.phase_times = {}
+        self.counters = {}
+        if self.enabled:
+            self.frame_number += 1
+            self.history.append(sample)
+            if self.log_file is not None:
+                self.write_sample(sample)
+        return sample
+
+    def open_log(self, path):
+        # This is to start writing every frame to a log file. A path ending in .csv gets one column for each phase and
+        # counter, anything else gets one JSON object per line.
+        self.log_file = open(path, 'w', newline='')
+        if path.lower().endswith('.csv'):
+            self.log_writer = csv.writer(self.log_file)
+            self.log_writer.writerow(['frame', 'state'] + [f"{phase}_ms" for phase in PROFILER_PHASES] +
+                                     PROFILER_COUNTERS)
+
+    def write_sample(self, sample):
+        # This is to write one frame to the log file with the times in milliseconds.
+        phases_ms = {phase: round(seconds * 1000, 4) for phase, seconds in sample["phases"].items()}
+        if self.log_writer is not None:
+            self.log_writer.writerow([sample["frame"], sample["state"]] +
+                                     [phases_ms.get(phase, 0.0) for phase in PROFILER_PHASES] +
+                                     [sample["counters"].get(counter, 0) for counter in PROFILER_COUNTERS])
+        else:
+            self.log_file.write(json.dumps({"frame": sample["frame"], "state": sample["state"],
+                                            "phases_ms": phases_ms, "counters": sample["counters"]}) + "\n")
+
+    def close_log(self):
+        # This is to close the log file when the game is closed.
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+            self.log_writer = None
+
+    def draw_overlay(self, game_screen, fps, fps_cap):
+        # This is to draw the performance overlay just under the HUD bar. It shows the frame rate and its cap, the
+        # average time of each phase over the last frames and the average of each counter. It returns the part of the
+        # screen it covered.
+        if self.overlay_font is None:
+            self.overlay_font = pygame.font.Font(None, 20)
+        frames = len(self.history) or 1
+        lines = [f"FPS {fps:.1f} / {fps_cap}"]
+        for phase in PROFILER_PHASES:
+            total = sum(sample["phases"].get(phase, 0.0) for sample in self.history)
+            lines.append(f"{phase:<10} {total * 1000 / frames:7.3f} ms")
+        for counter in PROFILER_COUNTERS:
+            total = sum(sample["counters"].get(counter, 0) for sample in self.history)
+            lines.append(f"{counter:<10} {total / frames:7.1f}")
+        panel = pygame.Surface((170, 8 + 16 * len(lines)), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 180))
+        for i, line in enumerate(lines):
+            panel.blit(self.overlay_font.render(line, True, (0, 255, 0)), (6, 4 + 16 * i))
+        return game_screen.blit(panel, (SCREEN_WIDTH - panel.get_width(), 30))
+
+
+# This is the profiler used when nothing is being measured.
+NULL_PROFILER = FrameProfiler(enabled=False)
+# This is the profiler of the game window. It is turned on when the overlay is shown or a log file is being written.
+frame_profiler = FrameProfiler(enabled=False)
+
+# These are the kinds of spawn the spawn scheduler plans.
+SPAWN_OBSTACLE, SPAWN_COIN, SPAWN_AMMO = 0, 1, 2
+
+
+class SpawnScheduler:
+    def __init__(self, rng):
+        # This is to plan when and where the obstacles, coins and ammo pickups spawn, a little ahead of time. Instead
+        # of rolling a dice for each of them every tick, it works out how many ticks there are until the next one,
+        # which gives the same chances. The lane of each spawn is checked when it is planned, so when the tick comes
+        # the game only takes the spawns that are due from the front of the list. It uses the random generator of the
+        # game so the same seed always plans the same spawns.
+        self.rng = rng
+        self.events = collections.deque()
+        # These are the ticks the next obstacle, coin and ammo pickup are due, and the tick up to which the spawns
+        # have been planned.
+        self.next_ticks = [0, 0, 0]
+        self.horizon = 0
+        # These are the ticks from which each lane is far enough from the last obstacle in it for another obstacle
+        # or an ammo pickup to spawn there.
+        self.obstacle_free_at = [0] * LANE_COUNT
+        self.ammo_free_at = [0] * LANE_COUNT
+
+    def gap(self, chance):
+        # This is how many ticks there are until the next spawn of something with a 1 in chance of spawning each tick.
+        if chance <= 1:
+            return 1
+        return int(math.log(1.0 - self.rng.random()) / math.log(1 - 1 / chance)) + 1
+
+    def reset(self, tick=0):
+        # This is to forget every planned spawn and start planning again from the tick.
+        self.events.clear()
+        self.next_ticks = [tick + self.gap(chance)
+                           for chance in (OBSTACLE_SPAWN_CHANCE, COIN_SPAWN_CHANCE, AMMO_SPAWN_CHANCE)]
+        self.horizon = tick
+        self.obstacle_free_at = [0] * LANE_COUNT
+        self.ammo_free_at = [0] * LANE_COUNT
+
+    def plan(self, tick, speed):
+        # This is to plan the spawns up to SPAWN_LOOKAHEAD_TICKS ahead. It only does any work when the planned spawns
+        # are running out, so most ticks it does nothing. The spawns are planned in the order they happen, with the
+        # obstacles before the coins and the ammo of the same tick, the same as they spawn.
+        if self.horizon > tick + SPAWN_LOOKAHEAD_TICKS // 2:
+            return
+        horizon = tick + SPAWN_LOOKAHEAD_TICKS
+        # The lanes are kept clear for as many ticks as the obstacle takes to move far enough at the current speed. The
+        # game only gets faster, so the obstacle is always at least that far away by then. An obstacle is safe to spawn
+        # when the last one in the lane has moved more than two obstacle heights down from the top, and an ammo pickup
+        # when there is no obstacle near the spot where it appears.
+        pixels_per_tick = max(1, int(speed))
+        obstacle_ticks = math.ceil(OBSTACLE_HEIGHT * 3 / pixels_per_tick)
+        ammo_ticks = math.ceil((AMMO_HEIGHT + OBSTACLE_HEIGHT) / pixels_per_tick)
+        rng = self.rng
+        next_ticks = self.next_ticks
+        while True:
+            kind = min(range(3), key=next_ticks.__getitem__)
+            due = next_ticks[kind]
+            if due > horizon:
+                break
+            if kind == SPAWN_OBSTACLE:
+                next_ticks[kind] = due + self.gap(OBSTACLE_SPAWN_CHANCE)
+                # This is to randomly generate the obstacles in the three middle lanes. If the lane is not safe yet the
+                # obstacle is not spawned.
+                lane = rng.randint(1, 3)
+                if due >= self.obstacle_free_at[lane]:
+                    self.events.append((due, kind, lane, rng.randrange(len(OBSTACLE_IMAGE_PATHS))))
+                    self.obstacle_free_at[lane] = due + obstacle_ticks
+                    self.ammo_free_at[lane] = due + ammo_ticks
+            elif kind == SPAWN_COIN:
+                next_ticks[kind] = due + self.gap(COIN_SPAWN_CHANCE)
+                self.events.append((due, kind, rng.randint(1, 3), 0))
+            else:
+                next_ticks[kind] = due + self.gap(AMMO_SPAWN_CHANCE)
+                # The ammo will not spawn in a lane where an obstacle overlaps the spot where the ammo appears.
+                possible_lanes = [lane for lane in (1, 2, 3) if due >= self.ammo_free_at[lane]]
+                if possible_lanes:
+                    self.events.append((due, kind, rng.choice(possible_lanes), 0))
+        self.horizon = horizon
+
+    def snapshot(self):
+        # This is to save the planned spawns and the state of the lanes for a checkpoint, as bytes.
+        header = CHECKPOINT_SPAWNER.pack(self.horizon, *self.next_ticks, *self.obstacle_free_at, *self.ammo_free_at,
+                                         len(self.events))
+        return header + b''.join(CHECKPOINT_SPAWN_EVENT.pack(*event) for event in self.events)
+
+    def restore(self, data, offset):
+        # This is to load what snapshot saved from the data at the offset. It returns the offset after it.
+        values = CHECKPOINT_SPAWNER.unpack_from(data, offset)
+        self.horizon = values[0]
+        self.next_ticks = list(values[1:4])
+        self.obstacle_free_at = list(values[4:4 + LANE_COUNT])
+        self.ammo_free_at = list(values[4 + LANE_COUNT:4 + LANE_COUNT * 2])
+        offset += CHECKPOINT_SPAWNER.size
+        self.events.clear()
+        for _ in range(values[-1]):
+            self.events.append(CHECKPOINT_SPAWN_EVENT.unpack_from(data, offset))
+            offset += CHECKPOINT_SPAWN_EVENT.size
+        return offset
+
+
+# A checkpoint is a snapshot of a game in the middle of being played. It starts with a header of the session and the
+# player, then the state of the random generator and the spawn scheduler, then one row for every entity. The rows of
+# every entity type have the same columns as the NumPy engine, so a checkpoint can be loaded by either engine.
+CHECKPOINT_MAGIC = b'RMCP'
+CHECKPOINT_VERSION = 2
+# magic, version, difficulty, tick, score, coins, move delay, queued shots, shots fired, game over, obstacle speed,
+# background speed, background y, player lane, player ammo, player coins, gauss flag, gauss value, entity counts
+CHECKPOINT_HEADER = struct.Struct('<4sHBIIIHHIBdddBIIBd5I')
+CHECKPOINT_RANDOM_STATE = struct.Struct('<625I')
+CHECKPOINT_ENTITY = struct.Struct('<iiiBhh')  # x, y, prev_y, lane, frame, counter
+# horizon, next ticks, obstacle free at and ammo free at for each lane, planned spawns
+CHECKPOINT_SPAWNER = struct.Struct(f'<I3I{LANE_COUNT}I{LANE_COUNT}IH')
+CHECKPOINT_SPAWN_EVENT = struct.Struct('<IBBB')  # tick, kind, lane, variant
+CHECKPOINT_ENTITY_TYPES = ['obstacles', 'bullets', 'ammo', 'coins', 'explosions']
+CHECKPOINT_SAVE_KEY = pygame.K_F5
+CHECKPOINT_LOAD_KEY = pygame.K_F9
+
+
+class GameSession:
+    def __init__(self, player_profile=None, seed=None):
+        # This is one game of Raccoon Madness. It holds the player, the entity pools and collision indexes, the speeds,
+        # the score and the tick counter. The step function moves the game forward by one fixed tick and does not draw
+        # anything, so the game can be stepped without a screen. All the random choices come from its own random
+        # generator, so the same seed and the same inputs always play the same game. The coins collected are added to
+        # the player profile, and headless games have no profile so the saved coins are not changed.
+        self.profile = player_profile
+        self.rng = random.Random(seed)
+        self.spawner = SpawnScheduler(self.rng)
+        self.profiler = NULL_PROFILER
+        # This is the batch of sprites the game is drawn with. It is made the first time the game is drawn.
+        self.batch = None
+        self.player = Player()
+        # These are the pools for the entities in the game. The active list of each pool is what is on the screen.
+        self.obstacle_pool = EntityPool(Obstacle)
+        self.bullet_pool = EntityPool(Bullet)
+        self.ammo_pool = EntityPool(AmmoPickup)
+        self.explosion_pool = EntityPool(Explosion)
+        self.coin_pool = EntityPool(Coin)
+        # These are the collision indexes that split the entities into the lanes they are in.
+        self.obstacle_index = LaneIndex(self.obstacle_pool)
+        self.ammo_index = LaneIndex(self.ammo_pool)
+        self.coin_index = LaneIndex(self.coin_pool)
+        self.difficulty = DIFFICULTY_LEVELS[0]
+        self.obstacle_speed = 0
+        self.background_speed = 0
+        self.background_y = 0
+        self.score = 0
+        self.collected_coins = 0
+        self.move_delay = 0
+        self.queued_shots = 0
+        self.shots_fired = 0
+        self.tick = 0
+        self.game_over = False
+
+    def reset(self, difficulty, seed=None):
+        # This is to start a new game at the given difficulty. The player starts in the middle lane with the ammo of the
+        # difficulty and every entity is given back to its pool. If a seed is given the random generator starts again
+        # from it.
+        if seed is not None:
+            self.rng.seed(seed)
+        self.spawner.reset()
+        settings = DIFFICULTY_SETTINGS[difficulty]
+        self.difficulty = difficulty
+        self.player = Player()
+        self.player.ammo = settings["ammo"]
+        self.obstacle_speed = settings["obstacle_speed"]
+        self.background_speed = self.obstacle_speed
+        self.background_y = 0
+        for pool in (self.obstacle_pool, self.bullet_pool, self.ammo_pool, self.explosion_pool, self.coin_pool):
+            pool.release_all()
+        for index in (self.obstacle_index, self.ammo_index, self.coin_index):
+            index.invalidate()
+        self.score = 0
+        self.collected_coins = 0
+        self.move_delay = 0
+        self.queued_shots = 0
+        self.shots_fired = 0
+        self.tick = 0
+        self.game_over = False
+
+    def bank_coins(self):
+        # This is to add the coins the player collected to the player profile. The profile saver writes it to the JSON
+        # file in the background so picking up a coin never waits for the disk.
+        if self.profile is not None and self.player.collected_coins:
+            self.profile.add_coins(self.player.collected_coins)
+            self.player.collected_coins = 0  # Reset the temporary coin count after saving.
+            profile_saver.mark_dirty()
+
+    def shoot(self):
+        # This is called when the space bar is pressed. The shot is fired on the next tick.
+        self.queued_shots += 1
+
+    def step(self, move_left, move_right):
+        # This is to move the game forward by one tick. move_left and move_right are if the arrow keys are held down.
+        profiler = self.profiler
+        # The entities move at the speed from the start of the tick, so a speed up moves them faster from the next tick.
+        obstacle_speed = self.obstacle_speed
+        profiler.begin('input')
+        self.handle_input(move_left, move_right)
+        profiler.end()
+        profiler.begin('spawn')
+        self.spawn_entities()
+        profiler.end()
+        profiler.begin('update')
+        self.update_entities(obstacle_speed)
+        profiler.end()
+        profiler.begin('collision')
+        self.check_collisions()
+        profiler.end()
+
+    def handle_input(self, move_left, move_right):
+        # This is to speed up the game, fire the queued shots and move the player for the tick.
+        player = self.player
+        self.tick += 1
+        # This is to increase the speed of the game every 10 seconds to make the game progressively more difficult.
+        if self.tick % SPEED_UP_TICKS == 0:
+            self.obstacle_speed += SPEED_UP_AMOUNT
+            self.background_speed += SPEED_UP_AMOUNT
+        self.background_y = (self.background_y + self.background_speed) % SCREEN_HEIGHT
+
+        while self.queued_shots > 0:
+            # This is to shoot the lasers for the space bar presses since the last tick.
+            self.queued_shots -= 1
+            if player.ammo > 0:
+                # It deducts the ammo amount and plays the laser sound
+                self.bullet_pool.acquire(player.rect.centerx, player.rect.y)
+                player.ammo -= 1
+                self.shots_fired += 1
+                play_sound(LASER_SOUND)
+
+        # This is to move the player left or right while the arrow keys are held, waiting a few ticks between moves.
+        if self.move_delay == 0:
+            if move_left:
+                player.move_left()
+                self.move_delay = MOVE_DELAY_TICKS
+            if move_right:
+                player.move_right()
+                self.move_delay = MOVE_DELAY_TICKS
+
+        if self.move_delay > 0:
+            self.move_delay -= 1
+
+    def spawn_entities(self):
+        # This is to spawn the obstacles, coins and ammo pickups that the spawn scheduler planned for this tick at the
+        # top of the screen.
+        self.spawner.plan(self.tick, self.obstacle_speed)
+        events = self.spawner.events
+        while events and events[0][0] <= self.tick:
+            tick, kind, lane, variant = events.popleft()
+            if kind == SPAWN_OBSTACLE:
+                self.obstacle_pool.acquire(lane, variant)
+                self.obstacle_index.invalidate()
+            elif kind == SPAWN_COIN:
+                self.coin_pool.acquire(lane)
+            else:
+                self.ammo_pool.acquire(lane)
+
+    def update_entities(self, obstacle_speed):
+        # This is to move every entity for the tick and give the ones that went off the screen back to their pools.
+        # The obstacles, ammo pickups and coins move down at the obstacle speed.
+        obstacle_pool = self.obstacle_pool
+        bullet_pool = self.bullet_pool
+        ammo_pool = self.ammo_pool
+        explosion_pool = self.explosion_pool
+        coin_pool = self.coin_pool
+        obstacles = obstacle_pool.active
+        bullets = bullet_pool.active
+        ammo_pickups = ammo_pool.active
+        explosions = explosion_pool.active
+        coins = coin_pool.active
+        # The entities are updated by going through the active lists backwards, so an entity that is given back to
+        # its pool can be swapped out without copying the lists.
+        for i in range(len(bullets) - 1, -1, -1):
+            # This is to update the bullet in the Bullet Class and check if it is off-screen
+            bullet = bullets[i]
+            bullet.update()
+            if bullet.is_off_screen():
+                bullet_pool.release(bullet)
+
+        for i in range(len(obstacles) - 1, -1, -1):
+            # This is to update the obstacle and speed in the Obstacle Class and check if it is off-screen and increase
+            # the score
+            obstacle = obstacles[i]
+            obstacle.speed = obstacle_speed
+            obstacle.update()
+            if obstacle.is_off_screen():
+                obstacle_pool.release(obstacle)
+                self.score += 1
+        self.obstacle_index.invalidate()
+
+        for i in range(len(ammo_pickups) - 1, -1, -1):
+            # This is to update the ammo and speed in the Ammo Class and check if it is off-screen.
+            ammo = ammo_pickups[i]
+            ammo.speed = obstacle_speed
+            ammo.update()
+            if ammo.is_off_screen():
+                ammo_pool.release(ammo)
+        self.ammo_index.invalidate()
+
+        for i in range(len(coins) - 1, -1, -1):
+            # This is to update the coins and speed in the Coin Class and check if it is off-screen.
+            coin = coins[i]
+            coin.speed = obstacle_speed
+            coin.update()
+            if coin.is_off_screen():
+                coin_pool.release(coin)
+        self.coin_index.invalidate()
+
+        for i in range(len(explosions) - 1, -1, -1):
+            # This is to check if there was an explosion and updates it in the Explosion Class.
+            explosion = explosions[i]
+            explosion.update()
+            if not explosion.active:
+                explosion_pool.release(explosion)
+
+    def check_collisions(self):
+        # This is to check what the player and the bullets hit in the tick.
+        player = self.player
+        obstacle_pool = self.obstacle_pool
+        bullet_pool = self.bullet_pool
+        ammo_pool = self.ammo_pool
+        coin_pool = self.coin_pool
+        bullets = bullet_pool.active
+        obstacle_index = self.obstacle_index
+        for ammo in self.ammo_index.query(player.rect):
+            # This is to increase the ammo collection if the player collected the ammo.
+            player.collect_ammo()
+            ammo_pool.release(ammo)
+
+        for coin in self.coin_index.query(player.rect):
+            # This is to increase the coins collected if the player collected a coin.
+            player.collect_coin()
+            self.collected_coins += 1
+            coin_pool.release(coin)
+            self.bank_coins()
+
+        for i in range(len(bullets) - 1, -1, -1):
+            # This is to check if the bullet collided with the object and plays the explosion sound and increases the
+            # players score by 5. Only the obstacles in the same lane and near the beams are checked.
+            bullet = bullets[i]
+            hits = obstacle_index.query(bullet.left_beam) or obstacle_index.query(bullet.right_beam)
+            if hits:
+                obstacle = hits[0]
+                obstacle_pool.release(obstacle)
+                bullet_pool.release(bullet)
+                self.explosion_pool.acquire(obstacle.rect.x, obstacle.rect.y)
+                play_sound(EXPLOSION_SOUND)
+                self.score += 5
+
+        if obstacle_index.query(player.rect):
+            # This is to check if the user collided in the obstacle, which ends the game.
+            self.game_over = True
+
+    def snapshot(self):
+        # This is to save everything about the game into a checkpoint, as bytes. Loading it with restore carries on
+        # with exactly the same game, including the random choices that come after it.
+        player = self.player
+        version, random_state, gauss = self.rng.getstate()
+        rows = self.entity_rows()
+        header = CHECKPOINT_HEADER.pack(
+            CHECKPOINT_MAGIC, CHECKPOINT_VERSION, DIFFICULTY_LEVELS.index(self.difficulty), self.tick, self.score,
+            self.collected_coins, self.move_delay, self.queued_shots, self.shots_fired, self.game_over,
+            self.obstacle_speed, self.background_speed, self.background_y, player.current_lane, player.ammo,
+            player.collected_coins, gauss is not None, gauss or 0.0,
+            *(len(rows[name]) for name in CHECKPOINT_ENTITY_TYPES))
+        entities = b''.join(CHECKPOINT_ENTITY.pack(*row) for name in CHECKPOINT_ENTITY_TYPES for row in rows[name])
+        return header + CHECKPOINT_RANDOM_STATE.pack(*random_state) + self.spawner.snapshot() + entities
+
+    def restore(self, data):
+        # This is to carry on from a checkpoint made by snapshot. It raises a ValueError if the data is not a checkpoint
+        # this version of the game can load.
+        if len(data) < CHECKPOINT_HEADER.size + CHECKPOINT_RANDOM_STATE.size or data[:4] != CHECKPOINT_MAGIC:
+            raise ValueError("this is not a checkpoint")
+        (magic, version, difficulty, tick, score, collected_coins, move_delay, queued_shots, shots_fired, game_over,
+         obstacle_speed, background_speed, background_y, lane, ammo, player_coins, has_gauss, gauss,
+         *counts) = CHECKPOINT_HEADER.unpack_from(data)
+        if version != CHECKPOINT_VERSION:
+            raise ValueError(f"this is a version {version} checkpoint, this game loads version {CHECKPOINT_VERSION}")
+        random_state = CHECKPOINT_RANDOM_STATE.unpack_from(data, CHECKPOINT_HEADER.size)
+        spawner = SpawnScheduler(self.rng)
+        rows = {}
+        try:
+            offset = spawner.restore(data, CHECKPOINT_HEADER.size + CHECKPOINT_RANDOM_STATE.size)
+            for name, count in zip(CHECKPOINT_ENTITY_TYPES, counts):
+                rows[name] = [CHECKPOINT_ENTITY.unpack_from(data, offset + i * CHECKPOINT_ENTITY.size)
+                              for i in range(count)]
+                offset += count * CHECKPOINT_ENTITY.size
+        except struct.error:
+            raise ValueError("the checkpoint is cut short")
+        # A broken file can have numbers that are not a difficulty or a lane, which would fail later in the middle of
+        # putting the game back, so they are checked before anything is changed.
+        if difficulty >= len(DIFFICULTY_LEVELS):
+            raise ValueError(f"the checkpoint has an unknown difficulty {difficulty}")
+        lanes = [lane] + [row[3] for name in ('obstacles', 'ammo', 'coins') for row in rows[name]] + \
+            [event[2] for event in spawner.events]
+        if any(not 0 <= entity_lane < LANE_COUNT for entity_lane in lanes):
+            raise ValueError("the checkpoint has a lane that is not on the road")
+
+        # The game is reset first so the speeds and ammo of the difficulty are set, and then everything in the
+        # checkpoint is put back over it.
+        self.reset(DIFFICULTY_LEVELS[difficulty])
+        self.rng.setstate((3, random_state, gauss if has_gauss else None))
+        self.spawner = spawner
+        self.tick = tick
+        self.score = score
+        self.collected_coins = collected_coins
+        self.move_delay = move_delay
+        self.queued_shots = queued_shots
+        self.shots_fired = shots_fired
+        self.game_over = bool(game_over)
+        self.obstacle_speed = obstacle_speed
+        self.background_speed = background_speed
+        self.background_y = background_y
+        self.player.current_lane = lane
+        self.player.rect.x = LANE_POSITIONS[lane]
+        self.player.ammo = ammo
+        self.player.collected_coins = player_coins
+        self.restore_entities(rows)
+        for index in (self.obstacle_index, self.ammo_index, self.coin_index):
+            index.invalidate()
+
+    def entity_rows(self):
+        # This is to get the row of every entity for a checkpoint, in the order they are in their pools.
+        return {
+            "obstacles": [(obstacle.rect.x, obstacle.rect.y, obstacle.prev_y, obstacle.lane, obstacle.variant, 0)
+                          for obstacle in self.obstacle_pool.active],
+            "bullets": [(bullet.left_beam.x, bullet.left_beam.y, bullet.prev_y, 0, 0, 0)
+                        for bullet in self.bullet_pool.active],
+            "ammo": [(ammo.rect.x, ammo.rect.y, ammo.prev_y, ammo.lane, 0, 0) for ammo in self.ammo_pool.active],
+            "coins": [(coin.rect.x, coin.rect.y, coin.prev_y, coin.lane, coin.current_frame, coin.frame_counter)
+                      for coin in self.coin_pool.active],
+            "explosions": [(explosion.rect.x, explosion.rect.y, explosion.rect.y, 0, explosion.current_frame, 0)
+                           for explosion in self.explosion_pool.active]
+        }
+
+    def restore_entities(self, rows):
+        # This is to put the entities of a checkpoint back into their pools, which were emptied by reset.
+        for x, y, prev_y, lane, variant, counter in rows["obstacles"]:
+            obstacle = self.obstacle_pool.acquire(lane, variant)
+            obstacle.rect.topleft = (x, y)
+            obstacle.prev_y = prev_y
+        for x, y, prev_y, lane, frame, counter in rows["bullets"]:
+            bullet = self.bullet_pool.acquire(x + 15, y)
+            bullet.prev_y = prev_y
+        for x, y, prev_y, lane, frame, counter in rows["ammo"]:
+            ammo = self.ammo_pool.acquire(lane)
+            ammo.rect.topleft = (x, y)
+            ammo.prev_y = prev_y
+        for x, y, prev_y, lane, frame, counter in rows["coins"]:
+            coin = self.coin_pool.acquire(lane)
+            coin.rect.topleft = (x, y)
+            coin.prev_y = prev_y
+            coin.current_frame = frame
+            coin.frame_counter = counter
+        for x, y, prev_y, lane, frame, counter in rows["explosions"]:
+            explosion = self.explosion_pool.acquire(x, y)
+            explosion.current_frame = frame
+
+    def entity_counts(self):
+        # This is to count how many of each entity are on the screen.
+        return {
+            "obstacles": len(self.obstacle_pool),
+            "bullets": len(self.bullet_pool),
+            "ammo": len(self.ammo_pool),
+            "coins": len(self.coin_pool),
+            "explosions": len(self.explosion_pool)
+        }
 
+    def draw(self, game_screen, alpha=1.0):
+        # This is to draw the game on the screen. Alpha is how far the game is between the last tick and the next one,
+        # so the background and entities are drawn between their last and current positions.
+        # The background moves down, so it is scrolled up by minus how far it has moved.
+        background_y = self.background_y - self.background_speed * (1 - alpha)
+        get_scroller(GAMEPLAY_BACKGROUND_PATH, vertical=True).draw(game_screen, -background_y)
+
+        # The sprites are collected in the same order they used to be drawn in and then drawn with one blits call.
+        if self.batch is None:
+            self.batch = SpriteBatch(get_atlas())
+        batch = self.batch
+        equipped_ammo = profile.equipped_ammo()["image_path"]
+        batch.ammo_key = ('ammo', equipped_ammo)
+        batch.beam_key = ('beam', equipped_ammo)
+
+        # This is to display the skin the user currently has equipped when they play the game.
+        batch.add(('skin', profile.equipped_skin()["image_path"]), self.player.rect.topleft)
+        self.add_entities_to_batch(batch, alpha)
+
+        # The background is one blit and the sprites are counted as one blit each.
+        self.profiler.count('blits', 1 + batch.draw(game_screen))
+
+    def add_entities_to_batch(self, batch, alpha):
+        # This is to add every entity to the sprites of the frame, in the order they used to be drawn in.
+        for pool in (self.obstacle_pool, self.bullet_pool, self.ammo_pool, self.coin_pool, self.explosion_pool):
+            for entity in pool.active:
+                entity.add_to_batch(batch, alpha)
+
+
+def round_like_rect(values):
+    # This is to round the positions the same way a pygame Rect does when a speed with a fraction is added to it, which
+    # is to the nearest whole pixel with halves rounded away from zero.
+    return numpy.trunc(values + numpy.copysign(0.5, values))
+
+
+class EntityArrays:
+    # These are the columns kept for every entity. Frame is the image of an obstacle or the animation frame of a coin
+    # or explosion, and counter is the delay between the frames of a coin.
+    COLUMNS = {'x': 'int32', 'y': 'int32', 'prev_y': 'int32', 'lane': 'int8', 'frame': 'int16', 'counter': 'int16',
+               'alive': 'bool'}
+
+    def __init__(self, entity_class, width, height, capacity=64):
+        # This is the NumPy version of an entity pool for one type of entity. Instead of one object for each entity,
+        # every value is kept in its own array, so all the entities of the type can be moved and checked for
+        # collisions with a few array operations. Removing an entity only clears its alive flag, and the dead ones are
+        # taken out of the arrays all at once by compact. It can also be used as the collision index of the entities,
+        # so it has the same lowest_top function as LaneIndex.
+        if numpy is None:
+            raise RuntimeError("The NumPy engine needs NumPy, install it with: pip install numpy")
+        self.entity_class = entity_class
+        self.width = width
+        self.height = height
+        self.count = 0
+        self.arrays = {name: numpy.zeros(capacity, dtype) for name, dtype in self.COLUMNS.items()}
+
+    def __getitem__(self, name):
+        # This is to get the values of one column for the entities in the arrays. It is a view, so changing it changes
+        # the entities.
+        return self.arrays[name][:self.count]
+
+    def __setitem__(self, name, values):
+        # This is to set the values of one column for the entities in the arrays.
+        self.arrays[name][:self.count] = values
+
+    def __len__(self):
+        return self.count
+
+    def acquire(self, *args):
+        # This is to add an entity. It takes the same values as the entity class and asks the class where the entity
+        # starts.
+        if self.count == len(self.arrays['x']):
+            self.grow(self.count + 1)
+        x, y, lane, frame = self.entity_class.array_values(*args)
+        i = self.count
+        self.count += 1
+        for name, value in (('x', x), ('y', y), ('prev_y', y), ('lane', lane), ('frame', frame), ('counter', 0),
+                            ('alive', True)):
+            self.arrays[name][i] = value
+        return i
+
+    def grow(self, size):
+        # This is to make the arrays twice as big until they have room for size entities.
+        capacity = len(self.arrays['x'])
+        while capacity < size:
+            capacity *= 2
+        for name, values in self.arrays.items():
+            bigger = numpy.zeros(capacity, values.dtype)
+            bigger[:self.count] = values[:self.count]
+            self.arrays[name] = bigger
+
+    def set_rows(self, rows):
+        # This is to replace every entity with rows of x, y, prev_y, lane, frame and counter, like in a checkpoint.
+        self.grow(len(rows))
+        self.count = len(rows)
+        if rows:
+            table = numpy.array(rows, numpy.int64)
+            for column, name in enumerate(('x', 'y', 'prev_y', 'lane', 'frame', 'counter')):
+                self[name] = table[:, column]
+        self['alive'] = True
+
+    def release(self, indexes):
+        # This is to remove the entities at the indexes. They stay in the arrays until the next compact.
+        self['alive'][indexes] = False
+
+    def compact(self):
+        # This is to take every dead entity out of the arrays in one go, keeping the order of the ones that are left.
+        alive = self['alive']
+        left = int(numpy.count_nonzero(alive))
+        if left < self.count:
+            for name, values in self.arrays.items():
+                values[:left] = values[:self.count][alive]
+            self.count = left
+
+    def release_all(self):
+        # This is to remove every entity when a new game starts.
+        self.count = 0
+
+    def invalidate(self):
+        # There is no index to rebuild because the arrays are always checked directly.
+        pass
+
+    def move(self, speed):
+        # This is to move every entity down the screen by the speed, keeping the position before the move.
+        y = self['y']
+        self['prev_y'][:] = y
+        y[:] = round_like_rect(y + speed)
+
+    def hits(self, rect, offset_x=0):
+        # This is to get the indexes of the live entities that collide with the rect, with the same rules as
+        # Rect.colliderect. offset_x moves the entities sideways first, which is used for the right beam of a bullet.
+        x = self['x'] + offset_x
+        y = self['y']
+        touching = self['alive'] & (x < rect.right) & (x + self.width > rect.left) & (y < rect.bottom) & \
+            (y + self.height > rect.top)
+        return numpy.flatnonzero(touching)
+
+    def overlaps(self, other, offset_x=0):
+        # This is to check every entity against every entity of the other arrays at once. It gives a table with a row
+        # for each entity and a column for each of the other entities, which is True where the two collide.
+        x = self['x'][:, None] + offset_x
+        y = self['y'][:, None]
+        return (other['alive'] & (x < other['x'] + other.width) & (x + self.width > other['x']) &
+                (y < other['y'] + other.height) & (y + self.height > other['y']))
+
+    def in_lane(self, lane):
+        # This is which live entities cover the lane column, the same way LaneIndex puts them into lanes.
+        x = self['x']
+        return self['alive'] & (x // LANE_WIDTH <= lane) & ((x + self.width - 1) // LANE_WIDTH >= lane)
+
+    def lowest_top(self, lane, below):
+        # This is to get the top of the lowest live entity in the lane whose top is above the given height, or None if
+        # there is no entity there.
+        tops = self['y'][self.in_lane(lane) & (self['y'] < below)]
+        return int(tops.max()) if len(tops) else None
+
+    def positions(self, alpha):
+        # This is to get the x and y of every entity between its last and current position as lists for drawing.
+        prev_y = self['prev_y']
+        return self['x'].tolist(), (prev_y + (self['y'] - prev_y) * alpha).tolist()
+
+
+class ArrayGameSession(GameSession):
+    def __init__(self, player_profile=None, seed=None):
+        # This is a game of Raccoon Madness that keeps its entities in NumPy arrays instead of objects. It plays by the
+        # same rules as GameSession, but moves the entities and checks the collisions with array operations, so it
+        # stays fast with thousands of entities. The arrays of each entity type are also its collision index.
+        super().__init__(player_profile, seed)
+        self.obstacle_pool = self.obstacle_index = EntityArrays(Obstacle, OBSTACLE_WIDTH, OBSTACLE_HEIGHT)
+        self.bullet_pool = EntityArrays(Bullet, 2, 20)
+        self.ammo_pool = self.ammo_index = EntityArrays(AmmoPickup, AMMO_WIDTH, AMMO_HEIGHT)
+        self.explosion_pool = EntityArrays(Explosion, 50, 50)
+        self.coin_pool = self.coin_index = EntityArrays(Coin, COIN_WIDTH, COIN_HEIGHT)
+
+    def update_entities(self, obstacle_speed):
+        # This is to move every entity for the tick with array operations and then take out the ones that went off the
+        # screen all at once.
+        bullets = self.bullet_pool
+        bullets['prev_y'][:] = bullets['y']
+        bullets['y'] -= 10
+        bullets['alive'] &= bullets['y'] >= 0
+
+        for arrays in (self.obstacle_pool, self.ammo_pool, self.coin_pool):
+            arrays.move(obstacle_speed)
+            off_screen = arrays['y'] > SCREEN_HEIGHT
+            if arrays is self.obstacle_pool:
+                # The player gets a point for every obstacle that went past.
+                self.score += int(numpy.count_nonzero(off_screen))
+            arrays['alive'] &= ~off_screen
+
+        # The coins move to their next frame every few ticks.
+        coins = self.coin_pool
+        coins['counter'] += 1
+        next_frame = coins['counter'] >= 5
+        coins['counter'][next_frame] = 0
+        coins['frame'][next_frame] = (coins['frame'][next_frame] + 1) % COIN_FRAME_COUNT
+
+        # The explosions are removed once their last frame has been shown.
+        explosions = self.explosion_pool
+        finished = explosions['frame'] >= EXPLOSION_FRAME_COUNT - 1
+        explosions['frame'][~finished] += 1
+        explosions['alive'] &= ~finished
+
+        for arrays in (bullets, self.obstacle_pool, self.ammo_pool, coins, explosions):
+            arrays.compact()
+
+    def check_collisions(self):
+        # This is to check what the player and the bullets hit in the tick with array operations.
+        player = self.player
+        obstacles = self.obstacle_pool
+        bullets = self.bullet_pool
+        hits = self.ammo_pool.hits(player.rect)
+        self.ammo_pool.release(hits)
+        for _ in hits:
+            player.collect_ammo()
+
+        hits = self.coin_pool.hits(player.rect)
+        self.coin_pool.release(hits)
+        for _ in hits:
+            player.collect_coin()
+            self.collected_coins += 1
+            self.bank_coins()
+
+        if len(bullets) and len(obstacles):
+            # Every beam is checked against every obstacle at once. Only the bullets that hit something are then gone
+            # through one at a time, newest first, so two bullets can not destroy the same obstacle. A bullet destroys
+            # the highest obstacle its left beam hits, or else the highest one its right beam hits.
+            left_hits = bullets.overlaps(obstacles)
+            right_hits = bullets.overlaps(obstacles, offset_x=30)
+            tops = obstacles['y']
+            for i in numpy.flatnonzero((left_hits | right_hits).any(axis=1))[::-1]:
+                for beam_hits in (left_hits[i], right_hits[i]):
+                    targets = numpy.flatnonzero(beam_hits & obstacles['alive'])
+                    if len(targets):
+                        target = targets[numpy.argmin(tops[targets])]
+                        obstacles.release(target)
+                        bullets.release(i)
+                        self.explosion_pool.acquire(int(obstacles['x'][target]), int(tops[target]))
+                        play_sound(EXPLOSION_SOUND)
+                        self.score += 5
+                        break
 
-def draw_button(text, rect):
+        if len(obstacles.hits(player.rect)):
+            # This is to check if the user collided in the obstacle, which ends the game.
+            self.game_over = True
+        for arrays in (obstacles, bullets, self.ammo_pool, self.coin_pool):
+            arrays.compact()
+
+    def entity_rows(self):
+        # This is to get the row of every entity for a checkpoint. The rows are the columns of the arrays.
+        columns = ('x', 'y', 'prev_y', 'lane', 'frame', 'counter')
+        pools = (self.obstacle_pool, self.bullet_pool, self.ammo_pool, self.coin_pool, self.explosion_pool)
+        return {name: list(zip(*(arrays[column].tolist() for column in columns)))
+                for name, arrays in zip(CHECKPOINT_ENTITY_TYPES, pools)}
+
+    def restore_entities(self, rows):
+        # This is to put the entities of a checkpoint back into the arrays.
+        pools = (self.obstacle_pool, self.bullet_pool, self.ammo_pool, self.coin_pool, self.explosion_pool)
+        for name, arrays in zip(CHECKPOINT_ENTITY_TYPES, pools):
+            arrays.set_rows(rows[name])
+
+    def add_entities_to_batch(self, batch, alpha):
+        # This is to add the sprites of every entity from the arrays, in the same order as GameSession.
+        obstacles = self.obstacle_pool
+        xs, ys = obstacles.positions(alpha)
+        for x, y, variant in zip(xs, ys, obstacles['frame'].tolist()):
+            batch.add(('obstacle', variant), (x, y))
+        xs, ys = self.bullet_pool.positions(alpha)
+        for x, y in zip(xs, ys):
+            batch.add(batch.beam_key, (x, round(y)))
+            batch.add(batch.beam_key, (x + 30, round(y)))
+        for x, y in zip(*self.ammo_pool.positions(alpha)):
+            batch.add(batch.ammo_key, (x, y))
+        coins = self.coin_pool
+        xs, ys = coins.positions(alpha)
+        for x, y, frame in zip(xs, ys, coins['frame'].tolist()):
+            batch.add(('coin', frame), (x, y))
+        explosions = self.explosion_pool
+        for x, y, frame in zip(explosions['x'].tolist(), explosions['y'].tolist(), explosions['frame'].tolist()):
+            batch.add(('explosion', frame), (x, y))
+
+
+# These are the engines a game can be played with. The objects engine is the normal one and the numpy engine keeps the
+# entities in NumPy arrays, which is faster when there are a lot of them.
+SESSION_ENGINES = {'objects': GameSession, 'numpy': ArrayGameSession}
+
+
+def bot_policy(session):
+    # This is a simple scripted player used by the headless mode. It looks at how much room there is above it in each
+    # lane. When an obstacle is getting close in its lane it shoots it if it has ammo, otherwise it moves towards the
+    # lane with the most room. It returns if the left and right arrow keys are held and if the space bar is pressed.
+    player = session.player
+    # The bot looks far enough ahead to get out of the way at the current speed.
+    look_ahead = session.obstacle_speed * (MOVE_DELAY_TICKS + 15)
+
+    def room(lane):
+        # This is how many pixels there are between the player and the closest obstacle above it in the lane.
+        top = session.obstacle_index.lowest_top(lane, player.rect.bottom)
+        return float('inf') if top is None else player.rect.top - (top + OBSTACLE_HEIGHT)
+
+    lane = player.current_lane
+    if room(lane) >= look_ahead:
+        # When its lane is clear it goes after the closest ammo pickup in a lane next to it that is also clear.
+        for other in (lane - 1, lane + 1):
+            if 1 <= other <= 3 and room(other) >= look_ahead and \
+                    session.ammo_index.lowest_top(other, player.rect.top) is not None:
+                return other < lane, other > lane, False
+        return False, False, False
+    if player.ammo > 0 and not len(session.bullet_pool):
+        return False, False, True
+    best_lane = max((1, 2, 3), key=lambda other: (room(other), -abs(other - lane)))
+    if best_lane < lane and room(lane - 1) > 0:
+        return True, False, False
+    if best_lane > lane and room(lane + 1) > 0:
+        return False, True, False
+    return False, False, False
+
+
+def run_headless(difficulty='Easy', seed=0, max_ticks=None, policy=bot_policy, engine='objects', checkpoint=None):
+    # This is to play one game without a screen or sounds as fast as the computer can. The policy decides the inputs
+    # every tick. The same difficulty, seed and policy always give the same result, which makes it useful for testing
+    # the gameplay and timing the game logic on its own. The engine is which of the SESSION_ENGINES plays the game.
+    # If a checkpoint is given the game carries on from it instead of starting at the beginning.
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    session = SESSION_ENGINES[engine](seed=seed)
+    session.reset(difficulty)
+    if checkpoint is not None:
+        session.restore(checkpoint)
+    while not session.game_over and (max_ticks is None or session.tick < max_ticks):
+        move_left, move_right, shoot = policy(session)
+        if shoot:
+            session.shoot()
+        session.step(move_left, move_right)
+    return {
+        "difficulty": session.difficulty,
+        "seed": seed,
+        "score": session.score,
+        "coins": session.collected_coins,
+        "shots": session.shots_fired,
+        "ammo_left": session.player.ammo,
+        "ticks": session.tick,
+        "game_over": session.game_over
+    }
+
+
+# A replay file starts with a header that has the difficulty, the seed and how the game ended, followed by one event
+# for every tick where the arrow keys changed or the space bar was pressed. Each event is the tick, the arrow keys as
+# bits and how many shots were fired in that tick.
+REPLAY_MAGIC = b'RMRP'
+REPLAY_VERSION = 2
+REPLAY_HEADER = struct.Struct('<4sHBIIIB')  # magic, version, difficulty, seed, ticks, score, game over
+REPLAY_EVENT = struct.Struct('<IBB')  # tick, keys, shots
+REPLAY_LEFT, REPLAY_RIGHT = 1, 2
+REPLAY_EXTENSION = '.rmr'
+
+
+class Replay:
+    def __init__(self, difficulty, seed):
+        # This is the recording of one game. The seed and the difficulty decide everything random in the game, so the
+        # only other thing that has to be kept is the input of each tick. Only the ticks where the input changed are
+        # kept, which makes a replay of a long game only a few kilobytes.
+        self.difficulty = difficulty
+        self.seed = seed
+        self.events = []
+        self.keys = 0
+        self.ticks = 0
+        self.score = 0
+        self.game_over = False
+
+    def record(self, tick, move_left, move_right, shots):
+        # This is called before each tick of the game with the arrow keys that are held and the shots waiting to be
+        # fired in it.
+        keys = (REPLAY_LEFT if move_left else 0) | (REPLAY_RIGHT if move_right else 0)
+        if keys != self.keys or shots:
+            self.events.append((tick, keys, min(shots, 255)))
+            self.keys = keys
+
+    def finish(self, session):
+        # This is to remember how far the game got, so playing the replay back can check it ends the same way.
+        self.ticks = session.tick
+        self.score = session.score
+        self.game_over = session.game_over
+
+    def save(self, path):
+        # This is to write the replay to a binary file.
+        header = REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, DIFFICULTY_LEVELS.index(self.difficulty), self.seed,
+                                    self.ticks, self.score, self.game_over)
+        write_file_atomic(path, header + b''.join(REPLAY_EVENT.pack(*event) for event in self.events))
+
+    @classmethod
+    def load(cls, path):
+        # This is to read a replay from a file. It raises a ValueError if the file is not a replay this version of the
+        # game can play.
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < REPLAY_HEADER.size or data[:4] != REPLAY_MAGIC:
+            raise ValueError(f"{path} is not a replay file")
+        magic, version, difficulty, seed, ticks, score, game_over = REPLAY_HEADER.unpack_from(data)
+        if version != REPLAY_VERSION:
+            raise ValueError(f"{path} is a version {version} replay, this game plays version {REPLAY_VERSION}")
+        if difficulty >= len(DIFFICULTY_LEVELS):
+            raise ValueError(f"{path} has an unknown difficulty {difficulty}")
+        if (len(data) - REPLAY_HEADER.size) % REPLAY_EVENT.size:
+            raise ValueError(f"{path} is cut short")
+        replay = cls(DIFFICULTY_LEVELS[difficulty], seed)
+        replay.events = list(REPLAY_EVENT.iter_unpack(data[REPLAY_HEADER.size:]))
+        replay.ticks = ticks
+        replay.score = score
+        replay.game_over = bool(game_over)
+        return replay
+
+    def inputs(self):
+        # This is to give back the input of every tick, starting from the first one, as the arrow keys that are held
+        # and how many shots are fired.
+        keys = 0
+        events = iter(self.events)
+        event = next(events, None)
+        tick = 0
+        while True:
+            shots = 0
+            if event is not None and event[0] == tick:
+                keys, shots = event[1], event[2]
+                event = next(events, None)
+            yield bool(keys & REPLAY_LEFT), bool(keys & REPLAY_RIGHT), shots
+            tick += 1
+
+
+def play_replay(session, replay):
+    # This is to play a replay as fast as the computer can, until the tick it was recorded to. The session can have a
+    # profiler, so a replay from a bug report can be timed.
+    session.reset(replay.difficulty, replay.seed)
+    inputs = replay.inputs()
+    while not session.game_over and session.tick < replay.ticks:
+        move_left, move_right, shots = next(inputs)
+        session.queued_shots += shots
+        session.step(move_left, move_right)
+    return {
+        "difficulty": replay.difficulty,
+        "seed": replay.seed,
+        "score": session.score,
+        "ticks": session.tick,
+        "game_over": session.game_over,
+        # The replay matches when the game ended in the same way as when it was recorded.
+        "matches": (session.score, session.tick, session.game_over) == (replay.score, replay.ticks, replay.game_over)
+    }
+
+
+class HudCounter:
+    def __init__(self, label, position):
+        # This is one of the counters on the HUD bar, like the score. It keeps the surface of its text and only renders
+        # it again when the value changes, so the HUD does not render any text in most frames.
+        self.label = label
+        self.position = position
+        self.value = None
+        self.surface = None
+
+    def draw(self, game_screen, value):
+        # This is to draw the counter with its value, rendering the text first if the value has changed.
+        if value != self.value or self.surface is None:
+            self.value = value
+            self.surface = TEXT_SCORE_FONT_STYLE.render(f"{self.label}: {value}", True, (255, 255, 255))
+        game_screen.blit(self.surface, self.position)
+
+
+# These are the counters shown on the HUD bar while playing.
+ammo_counter = HudCounter("Ammo", (10, 5))
+score_counter = HudCounter("Score", (250, 5))
+coin_counter = HudCounter("Coins", (480, 5))
+
+
+def draw_hud(session):
+    # This is to draw the amount of ammo, the amount of score, and the amount of coins while they user is playing the
+    # game so that they can keep track.
+    pygame.draw.rect(screen, (0, 0, 0), pygame.Rect(0, 0, 600, 30))
+    ammo_counter.draw(screen, session.player.ammo)
+    score_counter.draw(screen, session.score)
+    coin_counter.draw(screen, session.collected_coins)
+    session.profiler.count('blits', 4)
+
+
+# These are the places of the buttons on the menu pages. The pages use them to draw the buttons and the game loop uses
+# them to check which button was clicked.
+HOME_BUTTON_RECTS = [pygame.Rect(100, 300 + i * 80, 400, 60) for i in range(6)]
+GO_BACK_BUTTON_RECT = pygame.Rect(100, 720, 400, 50)
+GAME_OVER_BUTTON_RECTS = [pygame.Rect(200, 400, 200, 80), pygame.Rect(200, 500, 200, 80)]
+SKIN_BUTTON_Y = 350
+AMMO_BUTTON_Y = 610
+
+
+def item_button_rect(i, y):
+    # This is to get the place of the purchase or equip button of the item in the given column of the store.
+    return pygame.Rect(15 + i * 100, y, 70, 28)
+
+
+class Button:
+    def __init__(self, rect, action):
+        # This is a button that can be clicked on one of the pages. The action is called with the game when it is
+        # clicked.
+        self.rect = rect
+        self.action = action
+
+
+class HitTestIndex:
+    CELL_SIZE = 100
+
+    def __init__(self, buttons=()):
+        # This is to find the button under the mouse quickly. The screen is split into squares and each square keeps
+        # the buttons that are in it, so only the buttons in the square under the mouse need to be checked, however
+        # many items the store has.
+        self.cells = {}
+        for button in buttons:
+            self.add(button)
+
+    def add(self, button):
+        # This is to add a button to every square it is in.
+        size = self.CELL_SIZE
+        for column in range(button.rect.left // size, (button.rect.right - 1) // size + 1):
+            for row in range(button.rect.top // size, (button.rect.bottom - 1) // size + 1):
+                self.cells.setdefault((column, row), []).append(button)
+
+    def find(self, pos):
+        # This is to get the button at a point on the screen, or None if there is no button there.
+        for button in self.cells.get((pos[0] // self.CELL_SIZE, pos[1] // self.CELL_SIZE), ()):
+            if button.rect.collidepoint(pos):
+                return button
+        return None
+
+
+class ScreenUpdates:
+    def __init__(self):
+        # This is to keep track of the parts of the screen that changed in a frame, so only those parts are sent to
+        # the display instead of flipping the whole 600x800 screen. It is only used by the menus and the game over
+        # page. When the scrolling background moves, the whole screen has changed and it falls back to a full flip,
+        # which is what always happens while playing.
+        self.rects = []
+        self.full = True
+
+    def add(self, rect):
+        # This is to mark a part of the screen as changed.
+        if not self.full and rect is not None:
+            self.rects.append(pygame.Rect(rect))
+
+    def add_all(self):
+        # This is to mark the whole screen as changed.
+        self.full = True
+
+    def present(self):
+        # This is to send the changed parts of the screen to the display. Nothing is sent if nothing changed. It
+        # returns whether anything was sent.
+        sent = self.full or bool(self.rects)
+        if self.full:
+            pygame.display.flip()
+        elif self.rects:
+            pygame.display.update(self.rects)
+        self.full = False
+        self.rects = []
+        return sent
+
+
+# This is to keep track of what changed on the screen in the current frame.
+screen_updates = ScreenUpdates()
+
+
+class MenuLayer:
+    def __init__(self, draw_page, dimmed=False):
+        # This is a menu page that is drawn once and then reused. The page is only drawn again when its key changes,
+        # like when something is bought, or the mouse moves onto another button. A dimmed layer has the dark
+        # see-through layer that goes over the moving background under the page.
+        # The page is drawn twice, once over black and once over white. Over black it gives the colour the page adds,
+        # and the difference between the two gives how much of the background still shows through each pixel. With
+        # those two surfaces the page can be put over the moving background with one multiply blit and one add blit,
+        # and it looks exactly the same as drawing the whole page on the screen every frame.
+        self.draw_page = draw_page
+        self.dimmed = dimmed
+        self.key = None
+        self.hovered = None
+        self.colour = None
+        self.cover = None
+
+    def render(self, shade, page_args):
+        # This is to draw the page over a plain background of the given shade.
+        surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+        surface.fill((shade, shade, shade))
+        if self.dimmed:
+            dark_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+            dark_surface.set_alpha(150)
+            dark_surface.fill((0, 0, 0))
+            surface.blit(dark_surface, (0, 0))
+        self.draw_page(surface, *page_args)
+        return surface
+
+    def draw(self, game_screen, key, hovered, *page_args):
+        # This is to draw the layer on the screen, drawing the page again first if the key or the hovered button has
+        # changed. When only the hovered button changed, just the old and the new button are marked as changed on the
+        # screen, otherwise the whole page is.
+        if self.colour is None or key != self.key or hovered != self.hovered:
+            if self.colour is not None and key == self.key:
+                screen_updates.add(self.hovered)
+                screen_updates.add(hovered)
+            else:
+                screen_updates.add_all()
+            self.key = key
+            self.hovered = hovered
+            self.colour = self.render(0, page_args)
+            self.cover = self.render(255, page_args)
+            self.cover.blit(self.colour, (0, 0), special_flags=pygame.BLEND_RGB_SUB)
+        game_screen.blit(self.cover, (0, 0), special_flags=pygame.BLEND_RGB_MULT)
+        game_screen.blit(self.colour, (0, 0), special_flags=pygame.BLEND_RGB_ADD)
+        frame_profiler.count('blits', 2)
+
+
+def draw_button(game_screen, text, rect):
     # This is to create the buttons and give it the hover effect when the mouse interacts with the button.
     button_surface = pygame.Surface((rect.width, rect.height), pygame.SRCALPHA)
     mouse_pos = pygame.mouse.get_pos()
@@ -379,61 +2407,56 @@ def draw_button(text, rect):
     else:
         button_color = (0, 0, 0, 128)
     button_surface.fill(button_color)
-    screen.blit(button_surface, rect.topleft)
-    text_surface = NAV_BUTTON_FONT_STYLE.render(text, True, (255, 255, 255))
+    game_screen.blit(button_surface, rect.topleft)
+    text_surface = render_text(NAV_BUTTON_FONT_STYLE, text, (255, 255, 255))
     text_rect = text_surface.get_rect(center=rect.center)
-    screen.blit(text_surface, text_rect)
+    game_screen.blit(text_surface, text_rect)
+    frame_profiler.count('blits', 2)
 
 
-def render_controls(image, description, action, y_offset):
+def render_controls(game_screen, image, description, action, y_offset):
     # This function is used to render and set the items in the control page. It is used to get rid of repetitive code
-    screen.blit(image, (30, y_offset + 10))
-    description_text = HEADING_ONE_FONT_STYLE.render(description, True, (255, 255, 255))
-    screen.blit(description_text, (110, y_offset + 20))
-    action_text = HEADING_ONE_FONT_STYLE.render(action, True, (255, 255, 255))
-    screen.blit(action_text, (340, y_offset + 20))
+    game_screen.blit(image, (30, y_offset + 10))
+    description_text = render_text(HEADING_ONE_FONT_STYLE, description, (255, 255, 255))
+    game_screen.blit(description_text, (110, y_offset + 20))
+    action_text = render_text(HEADING_ONE_FONT_STYLE, action, (255, 255, 255))
+    game_screen.blit(action_text, (340, y_offset + 20))
 
 
-def home_page():
+def home_page(game_screen):
     # This is used for the home page to display the following information on the home page.
-    # It then loads the file to make sure if it exists or not to avoid any crashes of no files not existing. It loads
-    # the high score file as well.
-    load_skins()
-    highest_score = load_highest_score()
-    title_text = TITLE_FONT_STYLE.render("Raccoon Madness", True, (255, 255, 255))
-    screen.blit(title_text, title_text.get_rect(center=(SCREEN_WIDTH // 2, 50)))
-    coin_text = TITLE_FONT_STYLE.render(f"Highest Score: {highest_score}", True, (255, 255, 255))
-    screen.blit(coin_text, coin_text.get_rect(center=(SCREEN_WIDTH // 2, 120)))
+    # The highest score is read from the player profile that was loaded when the game started.
+    highest_score = profile.highest_score
+    title_text = render_text(TITLE_FONT_STYLE, "Raccoon Madness", (255, 255, 255))
+    game_screen.blit(title_text, title_text.get_rect(center=(SCREEN_WIDTH // 2, 50)))
+    coin_text = render_text(TITLE_FONT_STYLE, f"Highest Score: {highest_score}", (255, 255, 255))
+    game_screen.blit(coin_text, coin_text.get_rect(center=(SCREEN_WIDTH // 2, 120)))
     difficulty_text = DIFFICULTY_LEVELS[CURRENT_DIFFICULTY]
     # These are the buttons that are used to take the player to the following pages, and it is used to detect any clicks
     # from the mouse between those points.
-    draw_button("Play", pygame.Rect(100, 300, 400, 60))
-    draw_button(f"Level: {difficulty_text}", pygame.Rect(100, 380, 400, 60))
-    draw_button("Shop", pygame.Rect(100, 460, 400, 60))
-    draw_button("Story", pygame.Rect(100, 540, 400, 60))
-    draw_button("Controls", pygame.Rect(100, 620, 400, 60))
-    draw_button("Quit", pygame.Rect(100, 700, 400, 60))
-    pygame.display.flip()
+    labels = ["Play", f"Level: {difficulty_text}", "Shop", "Story", "Controls", "Quit"]
+    for label, rect in zip(labels, HOME_BUTTON_RECTS):
+        draw_button(game_screen, label, rect)
 
 
-def store_page(skin, ammo_colour):
-    # This is the store page where the items the user can purchase or equip can be seen.
-    title_text = TITLE_FONT_STYLE.render(" item store ", True, (255, 255, 255))
-    screen.blit(title_text, title_text.get_rect(center=(SCREEN_WIDTH // 2, 50)))
-    coins_text = STORY_FONT_STYLE.render(f"Available Coins: {load_skins()[2]}", True, (255, 255, 255))
-    screen.blit(coins_text, coins_text.get_rect(center=(SCREEN_WIDTH // 2, 100)))
-    raccoon_text = HEADING_ONE_FONT_STYLE.render("Raccoon Skins", True, (255, 255, 255))
-    screen.blit(raccoon_text, (15, 150))
+def store_page(game_screen, skin, ammo_colour):
+    # This is the store page where the items the user can purchase or equip can be seen. The coins are read from the
+    # player profile.
+    title_text = render_text(TITLE_FONT_STYLE, " item store ", (255, 255, 255))
+    game_screen.blit(title_text, title_text.get_rect(center=(SCREEN_WIDTH // 2, 50)))
+    coins_text = render_text(STORY_FONT_STYLE, f"Available Coins: {profile.coins}", (255, 255, 255))
+    game_screen.blit(coins_text, coins_text.get_rect(center=(SCREEN_WIDTH // 2, 100)))
+    raccoon_text = render_text(HEADING_ONE_FONT_STYLE, "Raccoon Skins", (255, 255, 255))
+    game_screen.blit(raccoon_text, (15, 150))
 
     mouse_pos = pygame.mouse.get_pos()
 
     for i, s in enumerate(skin):
         # it uses a for loop to load all the items in the file for the skins
-        skin_image = pygame.image.load(s["image_path"])
-        skin_image_resized = pygame.transform.scale(skin_image, (PLAYER_WIDTH, PLAYER_HEIGHT))
-        screen.blit(skin_image_resized, (25 + i * 100, 220))
-        label_text = ITEM_NAME_FONT_STYLE.render(s["name"], True, (255, 255, 255))
-        screen.blit(label_text, (25 + i * 100, 190))
+        skin_image = get_image(s["image_path"], PLAYER_WIDTH, PLAYER_HEIGHT)
+        game_screen.blit(skin_image, (25 + i * 100, 220))
+        label_text = render_text(ITEM_NAME_FONT_STYLE, s["name"], (255, 255, 255))
+        game_screen.blit(label_text, (25 + i * 100, 190))
         # Determine button text and label color
         if s["equipped"]:
             button_text = "SELECTED"
@@ -441,101 +2464,89 @@ def store_page(skin, ammo_colour):
             button_text = "EQUIP"
         else:
             button_text = "PURCHASE"
-        button_rect = pygame.Rect(15 + i * 100, 350, 70, 28)
+        button_rect = item_button_rect(i, SKIN_BUTTON_Y)
         if button_rect.collidepoint(mouse_pos):
             button_color = (150, 150, 150, 255)
             button_label_color = (0, 0, 0)
         else:
             button_color = (0, 0, 0, 128)
             button_label_color = (255, 255, 255)
-        pygame.draw.rect(screen, button_color, button_rect)
-        button_label = ITEM_BUTTON_FONT_STYLE.render(button_text, True, button_label_color)
+        pygame.draw.rect(game_screen, button_color, button_rect)
+        button_label = render_text(ITEM_BUTTON_FONT_STYLE, button_text, button_label_color)
         label_width = button_label.get_width()
         label_height = button_label.get_height()
         label_x = button_rect.x + (button_rect.width - label_width) // 2
         label_y = button_rect.y + (button_rect.height - label_height) // 2
-        screen.blit(button_label, (label_x, label_y))
+        game_screen.blit(button_label, (label_x, label_y))
         if not s["purchased"]:
-            price_label = ITEM_BUTTON_FONT_STYLE.render(f"{s['price']} Coins", True, (255, 255, 255))
-            screen.blit(price_label, (25 + i * 100, 320))
+            price_label = render_text(ITEM_BUTTON_FONT_STYLE, f"{s['price']} Coins", (255, 255, 255))
+            game_screen.blit(price_label, (25 + i * 100, 320))
 
-    ammo_text = HEADING_ONE_FONT_STYLE.render("ammo Colours", True, (255, 255, 255))
-    screen.blit(ammo_text, (15, 430))
+    ammo_text = render_text(HEADING_ONE_FONT_STYLE, "ammo Colours", (255, 255, 255))
+    game_screen.blit(ammo_text, (15, 430))
     mouse_pos = pygame.mouse.get_pos()
 
     for i, a in enumerate(ammo_colour):
         # This is the for loop for the ammo colours the user wants to purchase or select.
-        ammo_label_text = ITEM_NAME_FONT_STYLE.render(a["name"], True, (255, 255, 255))
-        screen.blit(ammo_label_text, (25 + i * 100, 480))
-        ammo_image = pygame.image.load(a["image_path"])
-        ammo_image_resized = pygame.transform.scale(ammo_image, (AMMO_WIDTH, AMMO_HEIGHT))
-        screen.blit(ammo_image_resized, (25 + i * 100, 520))
+        ammo_label_text = render_text(ITEM_NAME_FONT_STYLE, a["name"], (255, 255, 255))
+        game_screen.blit(ammo_label_text, (25 + i * 100, 480))
+        ammo_image = get_image(a["image_path"], AMMO_WIDTH, AMMO_HEIGHT)
+        game_screen.blit(ammo_image, (25 + i * 100, 520))
         if not a["purchased"]:
-            price_label = ITEM_BUTTON_FONT_STYLE.render(f"{a['price']} Coins", True, (255, 255, 255))
-            screen.blit(price_label, (25 + i * 100, 570))
+            price_label = render_text(ITEM_BUTTON_FONT_STYLE, f"{a['price']} Coins", (255, 255, 255))
+            game_screen.blit(price_label, (25 + i * 100, 570))
         if a["equipped"]:
             button_text = "SELECTED"
         elif a["purchased"]:
             button_text = "EQUIP"
         else:
             button_text = "PURCHASE"
-        button_rect = pygame.Rect(15 + i * 100, 610, 70, 28)
+        button_rect = item_button_rect(i, AMMO_BUTTON_Y)
         if button_rect.collidepoint(mouse_pos):
             button_color = (150, 150, 150, 255)
             button_label_color = (0, 0, 0)
         else:
             button_color = (0, 0, 0, 128)
             button_label_color = (255, 255, 255)
-        pygame.draw.rect(screen, button_color, button_rect)
-        button_label = ITEM_BUTTON_FONT_STYLE.render(button_text, True, button_label_color)
+        pygame.draw.rect(game_screen, button_color, button_rect)
+        button_label = render_text(ITEM_BUTTON_FONT_STYLE, button_text, button_label_color)
         label_width = button_label.get_width()
         label_height = button_label.get_height()
         label_x = button_rect.x + (button_rect.width - label_width) // 2
         label_y = button_rect.y + (button_rect.height - label_height) // 2
-        screen.blit(button_label, (label_x, label_y))
-    draw_button("Go Back", pygame.Rect(100, 720, 400, 50))
-    pygame.display.flip()
-
-
-def handle_click(raccoon_skins, ammo_color, player_coin, mouse_pos):
-    # This function is used to handle the logic of checking if the item was purchased, equipped or selected. It is used
-    # when the user enters the home page to display all the logic of what button should display what in the JSON file.
-    for i, skin in enumerate(raccoon_skins):
-        button_rect = pygame.Rect(15 + i * 100, 350, 70, 28)
-        if button_rect.collidepoint(mouse_pos):
-            if skin["purchased"]:
-                if not skin["equipped"]:
-                    for s in raccoon_skins:
-                        if s["equipped"]:
-                            s["equipped"] = False
-                    skin["equipped"] = True
-            else:
-                if player_coin >= skin["price"]:
-                    player_coin -= skin["price"]
-                    skin["purchased"] = True
-
-    for i, ammo in enumerate(ammo_color):
-        button_rect = pygame.Rect(15 + i * 100, 610, 70, 28)
-        if button_rect.collidepoint(mouse_pos):
-            if ammo["purchased"]:
-                if not ammo["equipped"]:
-                    for a in ammo_color:
-                        if a["equipped"]:
-                            a["equipped"] = False
-                    ammo["equipped"] = True
-            else:
-                if player_coin >= ammo["price"]:
-                    player_coin -= ammo["price"]
-                    ammo["purchased"] = True
-    save_skins(raccoon_skins, ammo_color, player_coin)
-    return player_coin
+        game_screen.blit(button_label, (label_x, label_y))
+    draw_button(game_screen, "Go Back", GO_BACK_BUTTON_RECT)
+
+
+def buy_or_equip(player_profile, items, index):
+    # This function is used when a purchase or equip button in the store is clicked. If the item was purchased it is
+    # equipped instead of the one that was equipped before, otherwise it is bought if the user has enough coins. The
+    # items are the skins or the ammo colours of the player profile. It only marks the profile to be saved when
+    # something was purchased or equipped.
+    item = items[index]
+    changed = False
+    with player_profile.lock:
+        if item["purchased"]:
+            if not item["equipped"]:
+                for other in items:
+                    if other["equipped"]:
+                        other["equipped"] = False
+                item["equipped"] = True
+                changed = True
+        else:
+            if player_profile.coins >= item["price"]:
+                player_profile.coins -= item["price"]
+                item["purchased"] = True
+                changed = True
+    if changed:
+        profile_saver.mark_dirty()
 
 
-def story_page():
+def story_page(game_screen):
     # This page is used for giving the background of why the user is playing as a raccoon and why they have laser goggles.
     # It helps the user feel more immersed in the story of the game.
-    title_text = TITLE_FONT_STYLE.render(" the raccoon story ", True, (255, 255, 255))
-    screen.blit(title_text, title_text.get_rect(center=(SCREEN_WIDTH // 2, 100)))
+    title_text = render_text(TITLE_FONT_STYLE, " the raccoon story ", (255, 255, 255))
+    game_screen.blit(title_text, title_text.get_rect(center=(SCREEN_WIDTH // 2, 100)))
     story_lines = [
         "In the late 3000s, Earth’s cities are ruled by robots,",
         "with no life remaining—except you, a lone raccoon",
@@ -550,440 +2561,542 @@ def story_page():
         "the robot-controlled metropolis."
     ]
     for i, line in enumerate(story_lines):
-        story_text = STORY_FONT_STYLE.render(line, True, (255, 255, 255))
-        screen.blit(story_text, story_text.get_rect(center=(SCREEN_WIDTH // 2, 170 + i * 30)))
-    screen.blit(story_raccoon_image, story_raccoon_image.get_rect(center=(SCREEN_WIDTH // 2, 580)))
-    draw_button("Go Back", pygame.Rect(100, 720, 400, 50))
-    pygame.display.flip()
+        story_text = render_text(STORY_FONT_STYLE, line, (255, 255, 255))
+        game_screen.blit(story_text, story_text.get_rect(center=(SCREEN_WIDTH // 2, 170 + i * 30)))
+    story_raccoon_image = get_image(*STORY_RACCOON_IMAGE)
+    game_screen.blit(story_raccoon_image, story_raccoon_image.get_rect(center=(SCREEN_WIDTH // 2, 580)))
+    draw_button(game_screen, "Go Back", GO_BACK_BUTTON_RECT)
 
 
-def controls_page():
+def controls_page(game_screen):
     # This is the controls page where it explains the controls, objectives, and obstacles in the game to help explain
     # to the user, so they can understand the game logic.
-    controls_title = SUBTITLE_FONT_STYLE.render("Controls:", True, (255, 255, 255))
-    screen.blit(controls_title, (30, 15))
-    render_controls(left_arrow_image, "left arrow key", "turns left", 50)
-    render_controls(right_arrow_image, "right arrow key", "turns right", 105)
-    render_controls(space_bar_image, "space bar key", "shoots lasers", 160)
-    obstacles_title = SUBTITLE_FONT_STYLE.render("Obstacles:", True, (255, 255, 255))
-    screen.blit(obstacles_title, (30, 240))
-    render_controls(obstacle_one_image, "purple security bot", "destroy with laser", 275)
-    render_controls(obstacle_two_image, "blue security bot", "destroy with laser", 330)
-    render_controls(obstacle_three_image, "green security bot", "destroy with laser", 385)
-    render_controls(obstacle_four_image, "trash can", "destroy with laser", 440)
-    items_title = SUBTITLE_FONT_STYLE.render("Items:", True, (255, 255, 255))
-    screen.blit(items_title, (30, 520))
-    for ammo in ammo_colors:
-        if ammo["equipped"]:
-            equipped_image = pygame.image.load(ammo["image_path"])
-            equipped_image = pygame.transform.scale(equipped_image, (AMMO_WIDTH, AMMO_HEIGHT))
-            render_controls(equipped_image, "laser ammunition", "used to shoot lasers", 555)
-            break
-    sprite_sheet = pygame.image.load("images/Coin_Sprite.png").convert_alpha()
-    sprite_sheet = pygame.transform.scale(sprite_sheet, (COIN_WIDTH, COIN_HEIGHT))
-    frame_width = COIN_WIDTH // 12
-    frames = [sprite_sheet.subsurface(pygame.Rect(i * frame_width, 0, frame_width, COIN_HEIGHT)) for i in range(12)]
-    render_controls(frames[0], "coins", "used to purchase items", 610)
-    draw_button("Go Back", pygame.Rect(100, 720, 400, 50))
-    pygame.display.flip()
-
-
-def game_over_page():
+    controls_title = render_text(SUBTITLE_FONT_STYLE, "Controls:", (255, 255, 255))
+    game_screen.blit(controls_title, (30, 15))
+    render_controls(game_screen, get_image(*LEFT_ARROW_IMAGE), "left arrow key", "turns left", 50)
+    render_controls(game_screen, get_image(*RIGHT_ARROW_IMAGE), "right arrow key", "turns right", 105)
+    render_controls(game_screen, get_image(*SPACE_BAR_IMAGE), "space bar key", "shoots lasers", 160)
+    obstacles_title = render_text(SUBTITLE_FONT_STYLE, "Obstacles:", (255, 255, 255))
+    game_screen.blit(obstacles_title, (30, 240))
+    obstacle_names = ["purple security bot", "blue security bot", "green security bot", "trash can"]
+    for i, (path, name) in enumerate(zip(OBSTACLE_IMAGE_PATHS, obstacle_names)):
+        render_controls(game_screen, get_image(path, OBSTACLE_WIDTH, OBSTACLE_HEIGHT), name, "destroy with laser",
+                        275 + i * 55)
+    items_title = render_text(SUBTITLE_FONT_STYLE, "Items:", (255, 255, 255))
+    game_screen.blit(items_title, (30, 520))
+    equipped_image = get_image(profile.equipped_ammo()["image_path"], AMMO_WIDTH, AMMO_HEIGHT)
+    render_controls(game_screen, equipped_image, "laser ammunition", "used to shoot lasers", 555)
+    frames = get_frames(COIN_SPRITE_PATH, COIN_FRAME_COUNT, 1, COIN_WIDTH, COIN_HEIGHT)
+    render_controls(game_screen, frames[0], "coins", "used to purchase items", 610)
+    draw_button(game_screen, "Go Back", GO_BACK_BUTTON_RECT)
+
+
+def game_over_page(game_screen):
     # This is the game over page when the user crashes or loses in the game. It will give the option of going back to the
     # home page or trying again.
-    game_text = GAME_OVER_FONT_STYLE.render("GAME", True, (255, 255, 255))
-    screen.blit(game_text, (140, 180))
-    over_text = GAME_OVER_FONT_STYLE.render("Over", True, (255, 255, 255))
-    screen.blit(over_text, (170, 280))
-    draw_button("Retry", pygame.Rect(200, 400, 200, 80))
-    draw_button("Home", pygame.Rect(200, 500, 200, 80))
-    pygame.display.flip()
-
-
-def game_loop():
-    # This is the main loop function for when the game plays. it sets all the initial variables for the game and plays
-    # the music of the home page since the application has just started.
-    global CURRENT_DIFFICULTY, player_coins, obstacle_speed, background_speed
-    clock = pygame.time.Clock()
-    player = Player()
-    obstacles = []
-    bullets = []
-    ammo_pickups = []
-    explosions = []
-    coins = []
-    collected_coins = 0
-    score = 0
-    running = True
-    move_delay = 0
-    state = 'HOME'
-    start_time = pygame.time.get_ticks()
-    play_music(HOME_PAGE_MUSIC)
-    background_y1 = 0
-    background_y2 = -SCREEN_HEIGHT
-    background_x1 = 0
-    background_x2 = home_background_image.get_width()
-
-    while running:
-        # It will take the user to the home page first where they will be able to select what page they want to view.
-        if state == 'HOME':
-            # it calls the home page function and displays the movement of the background image.
-            home_page()
-            background_x1 -= 0.15
-            background_x2 -= 0.15
-            if background_x1 <= -home_background_image.get_width():
-                background_x1 = home_background_image.get_width()
-            if background_x2 <= -home_background_image.get_width():
-                background_x2 = home_background_image.get_width()
-            screen.blit(home_background_image, (background_x1, 0))
-            screen.blit(home_background_image, (background_x2, 0))
-
-            for event in pygame.event.get():
-                # This is to listen where the mouse clicks to perform the following actions if the mouse interacts at
-                # these given points.
-                if event.type == pygame.QUIT:
-                    running = False
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    mouse_pos = event.pos
-                    if pygame.Rect(100, 300, 400, 60).collidepoint(mouse_pos):
-                        # This is for the playing game state when the user wants to play the game and will go to the
-                        # playing state. It will then stop the home music and begin the game play music.
-                        state = 'PLAYING'
-                        player = Player()
-                        player.ammo = DIFFICULTY_SETTINGS[DIFFICULTY_LEVELS[CURRENT_DIFFICULTY]]["ammo"]
-                        obstacle_speed = DIFFICULTY_SETTINGS[DIFFICULTY_LEVELS[CURRENT_DIFFICULTY]]["obstacle_speed"]
-                        background_speed = obstacle_speed
-                        obstacles = []
-                        bullets = []
-                        ammo_pickups = []
-                        explosions = []
-                        score = 0
-                        stop_music()
-                        play_music(GAME_PLAY_MUSIC)
-                    elif pygame.Rect(100, 380, 400, 60).collidepoint(mouse_pos):
-                        # This is to change the difficulty of the game when the user clicks this button.
-                        CURRENT_DIFFICULTY = (CURRENT_DIFFICULTY + 1) % len(DIFFICULTY_LEVELS)
-                    elif pygame.Rect(100, 460, 400, 60).collidepoint(mouse_pos):
-                        # This will call the store state which will be the store page
-                        state = 'STORE'
-                    elif pygame.Rect(100, 540, 400, 60).collidepoint(mouse_pos):
-                        # This will call the story state which will be the story page
-                        state = 'STORY'
-                    elif pygame.Rect(100, 620, 400, 60).collidepoint(mouse_pos):
-                        # This will call the controls state which will be the controls page
-                        state = 'CONTROLS'
-                    elif pygame.Rect(100, 700, 400, 60).collidepoint(mouse_pos):
-                        # This will close the application as it is to close the game
-                        running = False
-        elif state == 'STORE':
-            # This state is for the store. It creates the background movement for the background image
-            background_x1 -= 0.15
-            background_x2 -= 0.15
-            if background_x1 <= -home_background_image.get_width():
-                background_x1 = home_background_image.get_width()
-            if background_x2 <= -home_background_image.get_width():
-                background_x2 = home_background_image.get_width()
-            screen.blit(home_background_image, (background_x1, 0))
-            screen.blit(home_background_image, (background_x2, 0))
-            rect_surface = pygame.Surface((600, 800))
-            rect_surface.set_alpha(150)
-            rect_surface.fill((0, 0, 0))
-            screen.blit(rect_surface, (0, 0))
-
-            # It then calls the storepage function where it will display all the information in the store based on the
-            # JSON file
-            store_page(skins, ammo_colors)
-
-            for event in pygame.event.get():
-                # This then listens to see which button is clicked. There is a go back button and the handle click
-                # button function.
-                if event.type == pygame.QUIT:
-                    running = False
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    mouse_pos = event.pos
-                    if pygame.Rect(100, 720, 400, 50).collidepoint(mouse_pos):
-                        state = 'HOME'
-                    else:
-                        player_coins = handle_click(skins, ammo_colors, player_coins, mouse_pos)
-            pygame.display.flip()
-
-        elif state == 'STORY':
-            # This state is for the Story page. It will load the information from the story page function and have the
-            # moving background image of the home background.
-            story_page()
-            background_x1 -= 0.15
-            background_x2 -= 0.15
-            if background_x1 <= -home_background_image.get_width():
-                background_x1 = home_background_image.get_width()
-            if background_x2 <= -home_background_image.get_width():
-                background_x2 = home_background_image.get_width()
-            screen.blit(home_background_image, (background_x1, 0))
-            screen.blit(home_background_image, (background_x2, 0))
-            rect_surface = pygame.Surface((600, 800))
-            rect_surface.set_alpha(150)
-            rect_surface.fill((0, 0, 0))
-            screen.blit(rect_surface, (0, 0))
-
-            for event in pygame.event.get():
-                # This is to listen to the action of the mouse and see what action needs to be performed. Which will
-                # be the go back button to the home page.
-                if event.type == pygame.QUIT:
-                    running = False
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    mouse_pos = event.pos
-                    if pygame.Rect(100, 720, 400, 50).collidepoint(mouse_pos):
-                        state = 'HOME'
-
-        elif state == 'CONTROLS':
-            # This state is for the controls page where it displays the information from the controls page function.
-            # It also loads the background movement of the home background image.
-            controls_page()
-            background_x1 -= 0.15
-            background_x2 -= 0.15
-            if background_x1 <= -home_background_image.get_width():
-                background_x1 = home_background_image.get_width()
-            if background_x2 <= -home_background_image.get_width():
-                background_x2 = home_background_image.get_width()
-            screen.blit(home_background_image, (background_x1, 0))
-            screen.blit(home_background_image, (background_x2, 0))
-            rect_surface = pygame.Surface((600, 800))
-            rect_surface.set_alpha(150)
-            rect_surface.fill((0, 0, 0))
-            screen.blit(rect_surface, (0, 0))
-
-            for event in pygame.event.get():
-                # This is to listen to the mouse and see what it pushes which is the go back button which will take
-                # the user back to the home page.
-                if event.type == pygame.QUIT:
-                    running = False
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    mouse_pos = event.pos
-                    if pygame.Rect(100, 720, 400, 50).collidepoint(mouse_pos):
-                        state = 'HOME'
-
-        elif state == 'PLAYING':
-            # This state is for when the user is playing the video game. The background image will be changed to the
-            # gameplay background where it will move in a different direction.
-            screen.blit(gameplay_background_image, (0, background_y1))
-            screen.blit(gameplay_background_image, (0, background_y2))
-            background_y1 += background_speed
-            background_y2 += background_speed
-            if background_y1 >= SCREEN_HEIGHT:
-                background_y1 = -SCREEN_HEIGHT
-            if background_y2 >= SCREEN_HEIGHT:
-                background_y2 = -SCREEN_HEIGHT
-            screen.blit(gameplay_background_image, (0, background_y1))
-            screen.blit(gameplay_background_image, (0, background_y2))
-
-            current_time = pygame.time.get_ticks()
-            # This is to increase the speed of the game every 10 seconds to make the game progressively more difficult.
-            if (current_time - start_time) // 1000 >= 10:
-                obstacle_speed += 0.25
-                background_speed += 0.25
-                start_time = current_time
-
-            for event in pygame.event.get():
-                # This is to listen to the key bind of the space bar being pressed. This is used to shoot the ammo of the
-                # laser.
-                if event.type == pygame.QUIT:
-                    running = False
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_SPACE and player.ammo > 0:
-                        # It deducts the ammo amount and plays the laser sound
-                        bullets.append(Bullet(player.rect.centerx, player.rect.y))
-                        player.ammo -= 1
-                        laser_sound.play()
-
-            keys = pygame.key.get_pressed()
-            # This is to listen to what key is pressed for the movement. The user can move left or right
-            if move_delay == 0:
-                if keys[pygame.K_LEFT]:
-                    player.move_left()
-                    move_delay = 10
-                if keys[pygame.K_RIGHT]:
-                    player.move_right()
-                    move_delay = 10
-
-            if move_delay > 0:
-                move_delay -= 1
-
-            if random.randint(1, 50) == 1:
-                # This is to randomly generate the obstacles on the screen making it more common.
-                # It will only spawn in the three lanes
-                lane = random.randint(1, 3)
-                safe_to_spawn = True
-                for obstacle in obstacles:
-                    if obstacle.lane == lane and obstacle.rect.y < OBSTACLE_HEIGHT * 2:
-                        safe_to_spawn = False
-                        break
-                if safe_to_spawn:
-                    obstacles.append(Obstacle(lane))
-
-            if random.randint(1, 200) == 1:
-                # This is to randomly generate the coins on the screen making it a bit rare.
-                lane = random.randint(1, 3)
-                coins.append(Coin(lane))
-
-            if random.randint(1, 150) == 1:
-                # This is to randomly generate the ammo on the screen making it slightly rare.
-                possible_lanes = [1, 2, 3]
-                for obstacle in obstacles:
-                    if obstacle.rect.y < AMMO_HEIGHT and obstacle.rect.y + OBSTACLE_HEIGHT > -AMMO_HEIGHT:
-                        if obstacle.lane in possible_lanes:
-                            possible_lanes.remove(obstacle.lane)
-                if possible_lanes:
-                    lane = random.choice(possible_lanes)
-                    ammo_pickups.append(AmmoPickup(lane))
-
-            for bullet in bullets[:]:
-                # This is to update the bullet in the Bullet Class and check if it is off-screen
-                bullet.update()
-                if bullet.is_off_screen():
-                    bullets.remove(bullet)
-
-            for obstacle in obstacles[:]:
-                # This is to update the obstacle and speed in the Obstacle Class and check if it is off-screen and increase
-                # the score
-                obstacle.speed = obstacle_speed
-                obstacle.update()
-                if obstacle.is_off_screen():
-                    obstacles.remove(obstacle)
-                    score += 1
-
-            for ammo in ammo_pickups[:]:
-                # This is to update the ammo and speed in the Ammo Class and check if it is off-screen and increase the ammo
-                # collection if the player collected the ammo.
-                ammo.speed = obstacle_speed
-                ammo.update()
-                if ammo.is_off_screen():
-                    ammo_pickups.remove(ammo)
-                if player.rect.colliderect(ammo.rect):
-                    player.collect_ammo()
-                    ammo_pickups.remove(ammo)
-
-            for coin in coins[:]:
-                # This is to update the coins and speed in the Coin Class and check if it is off-screen and increase the coins
-                # collected if the player collected a coin
-                coin.speed = obstacle_speed
-                coin.update()
-                if coin.is_off_screen():
-                    coins.remove(coin)
-                if player.rect.colliderect(coin.rect):
-                    player.collect_coin()
-                    collected_coins += 1
-                    coins.remove(coin)
-
-            for explosion in explosions[:]:
-                # This is to check if there was an explosion and updates it in the Explosion Class.
-                explosion.update()
-                if not explosion.active:
-                    explosions.remove(explosion)
-
-            for bullet in bullets[:]:
-                # This is to check if the bullet collided with the object and plays the explosion sound and increases the
-                # players score by 5.
-                for obstacle in obstacles[:]:
-                    if bullet.left_beam.colliderect(obstacle.rect) or bullet.right_beam.colliderect(obstacle.rect):
-                        obstacles.remove(obstacle)
-                        bullets.remove(bullet)
-                        explosions.append(Explosion(obstacle.rect.x, obstacle.rect.y))
-                        explosion_sound.play()
-                        score += 5
-                        break
-
-            for obstacle in obstacles:
-                # This is to check if the user collided in the obstacle and stops the music and calls the GAME OVER state
-                # to show that the game is over.
-                if player.rect.colliderect(obstacle.rect):
-                    stop_music()
-                    rect_surface = pygame.Surface((600, 800))
-                    rect_surface.set_alpha(150)
-                    rect_surface.fill((0, 0, 0))
-                    screen.blit(rect_surface, (0, 0))
-                    play_music(GAME_OVER_MUSIC)
-                    state = 'GAME_OVER'
-
-            for skin in skins:
-                # This is to display the skin the user currently has equipped when they play the game.
-                if skin["equipped"]:
-                    equipped_image = pygame.image.load(skin["image_path"])
-                    equipped_image = pygame.transform.scale(equipped_image, (PLAYER_WIDTH, PLAYER_HEIGHT))
-                    screen.blit(equipped_image, player.rect.topleft)
-                    break
-
-            for obstacle in obstacles:
-                # This is to draw the obstacles on the screen
-                obstacle.draw(screen)
-
-            for bullet in bullets:
-                # This is to draw the bullets on the screen
-                bullet.draw(screen)
-
-            for ammo in ammo_pickups:
-                # This is to draw the ammo on the screen
-                ammo.draw(screen)
-
-            for coin in coins:
-                # This is to draw the coins on the screen
-                coin.draw(screen)
-
-            for explosion in explosions:
-                # This is to draw the explosion on the screen
-                explosion.draw(screen)
-
-            pygame.draw.rect(screen, (0, 0, 0), pygame.Rect(0, 0, 600, 30))
-            # This is to draw the amount of ammo, the amount of score, and the amount of coins while they user is playing
-            # the game so that they can keep track.
-            ammo_text = TEXT_SCORE_FONT_STYLE.render(f"Ammo: {player.ammo}", True, (255, 255, 255))
-            screen.blit(ammo_text, (10, 5))
-            score_text = TEXT_SCORE_FONT_STYLE.render(f"Score: {score}", True, (255, 255, 255))
-            screen.blit(score_text, (250, 5))
-            coin_text = TEXT_SCORE_FONT_STYLE.render(f"Coins: {collected_coins}", True, (255, 255, 255))
-            screen.blit(coin_text, (480, 5))
-            pygame.display.flip()
-            clock.tick(60)
-
-        elif state == 'GAME_OVER':
-            # This is when the game over state is called and displays the game over function that will display all the information
-            # inside that function.
-            game_over_page()
-
-            for event in pygame.event.get():
-                # It will then listen to the option the user wants to select. They can either select the button to retry and will
-                # restart the game from the beginning again. Or they can select the go back button which will take the user back to
-                # the home page incase they want to go to a different page or change the difficulty.
+    game_text = render_text(GAME_OVER_FONT_STYLE, "GAME", (255, 255, 255))
+    game_screen.blit(game_text, (140, 180))
+    over_text = render_text(GAME_OVER_FONT_STYLE, "Over", (255, 255, 255))
+    game_screen.blit(over_text, (170, 280))
+    draw_button(game_screen, "Retry", GAME_OVER_BUTTON_RECTS[0])
+    draw_button(game_screen, "Home", GAME_OVER_BUTTON_RECTS[1])
+
+
+def store_key(player_profile):
+    # This is the key of the store layer. The store is drawn again when the coins change or something is bought or
+    # equipped.
+    items = tuple((item["purchased"], item["equipped"]) for item in player_profile.skins + player_profile.ammo_colours)
+    return player_profile.coins, items
+
+
+# These are the layers of the menu pages.
+home_layer = MenuLayer(home_page)
+store_layer = MenuLayer(store_page, dimmed=True)
+story_layer = MenuLayer(story_page, dimmed=True)
+controls_layer = MenuLayer(controls_page, dimmed=True)
+game_over_layer = MenuLayer(game_over_page)
+
+
+class FramePacer:
+    def __init__(self, frame_rates):
+        # This is to keep each page of the game to its frame rate cap so the game does not use a whole core of the
+        # computer to draw the menus. It also keeps how many frames each page was drawn in and for how long, to work
+        # out the frame rate each page really got.
+        self.clock = pygame.time.Clock()
+        self.frame_rates = frame_rates
+        self.frames = {}
+        self.seconds = {}
+
+    def frame_rate(self, state):
+        # This is to get the frame rate cap of a page.
+        return self.frame_rates.get(state, FRAME_RATE)
+
+    def wait_for_events(self, timeout_ms):
+        # This is to sleep until there is an event, like the mouse moving or a key being pressed, or until the timeout.
+        # It is used when nothing on the screen is changing. It returns the events the same as pygame.event.get.
+        event = pygame.event.wait(timeout_ms)
+        events = pygame.event.get()
+        if event.type != pygame.NOEVENT:
+            events.insert(0, event)
+        return events
+
+    def tick(self, state):
+        # This is to end the frame. It waits if the frame was quicker than the cap of the page and returns the seconds
+        # since the last frame.
+        seconds = self.clock.tick(self.frame_rate(state)) / 1000
+        self.frames[state] = self.frames.get(state, 0) + 1
+        self.seconds[state] = self.seconds.get(state, 0.0) + seconds
+        return seconds
+
+    def restart(self):
+        # This is to start timing again from now, so the time spent before is not counted in the next frame.
+        self.clock.tick()
+
+    def fps(self):
+        # This is the frame rate of the last few frames.
+        return self.clock.get_fps()
+
+    def achieved_frame_rates(self):
+        # This is to get the frame rate each page really got over the whole time it was shown.
+        return {state: round(self.frames[state] / self.seconds[state], 1)
+                for state in self.frames if self.seconds[state] > 0}
+
+
+class Scene:
+    def __init__(self, buttons=()):
+        # This is one of the pages of the game. Each page registers its buttons once, and the clicks and the mouse
+        # hovering are looked up in its hit test index.
+        self.buttons = list(buttons)
+        self.hit_index = HitTestIndex(self.buttons)
+
+    def hovered_rect(self):
+        # This is to get the rect of the button the mouse is over, or None if it is not over a button.
+        button = self.hit_index.find(pygame.mouse.get_pos())
+        return button.rect if button is not None else None
+
+    def handle_event(self, game, event):
+        # This is to do the action of the button that was clicked.
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            button = self.hit_index.find(event.pos)
+            if button is not None:
+                button.action(game)
+
+    def frame(self, game):
+        # This is to draw the page for one frame.
+        pass
+
+
+class MenuScene(Scene):
+    def __init__(self, layer, buttons, page_key=None, page_args=None):
+        # This is a menu page with the moving home background under its layer. The page key and page arguments are
+        # functions that give the key of the layer and what the page needs to be drawn.
+        super().__init__(buttons)
+        self.layer = layer
+        self.page_key = page_key or (lambda: None)
+        self.page_args = page_args or (lambda: ())
+
+    def draw_background(self, game):
+        # This is to draw what goes under the layer of the page.
+        game.draw_menu_background()
+
+    def frame(self, game):
+        # This is to draw the background and then the layer of the page.
+        frame_profiler.begin('draw')
+        self.draw_background(game)
+        self.layer.draw(screen, self.page_key(), self.hovered_rect(), *self.page_args())
+        frame_profiler.end()
+
+
+class GameOverScene(MenuScene):
+    def draw_background(self, game):
+        # The game over page goes over the last frame of the game instead of the moving background.
+        screen.blit(game.game_over_background, (0, 0))
+
+
+class PlayingScene(Scene):
+    def handle_event(self, game, event):
+        # This is to listen to the key bind of the space bar being pressed. This is used to shoot the ammo of the
+        # laser.
+        # While a replay is played the shots come from the replay instead.
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE and game.replay is None:
+            game.session.shoot()
+        # These are to save the game to a checkpoint and to go back to the last checkpoint, when the game was started
+        # with a checkpoint.
+        elif event.type == pygame.KEYDOWN and event.key == CHECKPOINT_SAVE_KEY and game.start_from_checkpoint:
+            game.save_checkpoint()
+        elif event.type == pygame.KEYDOWN and event.key == CHECKPOINT_LOAD_KEY and game.start_from_checkpoint and \
+                game.replay is None:
+            game.load_checkpoint()
+
+    def frame(self, game):
+        # This is for when the user is playing the video game. The game logic runs in fixed ticks and the screen is
+        # drawn once per frame, so the game plays at the same speed whatever the frame rate is.
+        session = game.session
+        keys = pygame.key.get_pressed()
+        # This is to run as many ticks as the time since the last frame allows. The user can move left or right with
+        # the arrow keys, and the input of each tick is recorded if replays are being recorded.
+        while game.accumulator >= TICK_SECONDS and not session.game_over:
+            if game.replay_inputs is not None:
+                move_left, move_right, shots = next(game.replay_inputs)
+                session.queued_shots += shots
+            else:
+                move_left, move_right = keys[pygame.K_LEFT], keys[pygame.K_RIGHT]
+            if game.recording is not None:
+                game.recording.record(session.tick, move_left, move_right, session.queued_shots)
+            session.step(move_left, move_right)
+            game.accumulator -= TICK_SECONDS
+        if frame_profiler.enabled:
+            frame_profiler.count('entities', sum(session.entity_counts().values()))
+
+        frame_profiler.begin('draw')
+        session.draw(screen, game.accumulator / TICK_SECONDS)
+        draw_hud(session)
+        frame_profiler.end()
+
+        if session.game_over:
+            game.end_game()
+
+
+def build_scenes(player_profile):
+    # This is the table of the pages of the game with their buttons. The buttons are only made once here, and the game
+    # loop looks up the page of the current state in this table.
+    store_buttons = [Button(GO_BACK_BUTTON_RECT, lambda game: game.leave_store())]
+    for i in range(len(player_profile.skins)):
+        store_buttons.append(Button(item_button_rect(i, SKIN_BUTTON_Y),
+                                    lambda game, i=i: buy_or_equip(player_profile, player_profile.skins, i)))
+    for i in range(len(player_profile.ammo_colours)):
+        store_buttons.append(Button(item_button_rect(i, AMMO_BUTTON_Y),
+                                    lambda game, i=i: buy_or_equip(player_profile, player_profile.ammo_colours, i)))
+    go_back_button = Button(GO_BACK_BUTTON_RECT, lambda game: game.go_to('HOME'))
+    home_actions = [
+        lambda game: game.start_game(),
+        lambda game: game.next_difficulty(),
+        lambda game: game.go_to('STORE'),
+        lambda game: game.go_to('STORY'),
+        lambda game: game.go_to('CONTROLS'),
+        lambda game: game.quit()
+    ]
+    return {
+        'HOME': MenuScene(home_layer, [Button(rect, action) for rect, action in zip(HOME_BUTTON_RECTS, home_actions)],
+                          lambda: (player_profile.highest_score, CURRENT_DIFFICULTY)),
+        'STORE': MenuScene(store_layer, store_buttons, lambda: store_key(player_profile),
+                           lambda: (player_profile.skins, player_profile.ammo_colours)),
+        'STORY': MenuScene(story_layer, [go_back_button]),
+        # The controls page shows the equipped ammo, so it is drawn again when that changes.
+        'CONTROLS': MenuScene(controls_layer, [go_back_button], lambda: player_profile.equipped_ammo()["name"]),
+        'PLAYING': PlayingScene(),
+        'GAME_OVER': GameOverScene(game_over_layer, [Button(GAME_OVER_BUTTON_RECTS[0], lambda game: game.start_game()),
+                                                     Button(GAME_OVER_BUTTON_RECTS[1], lambda game: game.go_home())])
+    }
+
+
+class Game:
+    def __init__(self, seed=None, profile_log=None, engine='objects', replay_folder=None, replay=None,
+                 checkpoint=None):
+        # This is the game with the window. It keeps everything the pages share, like the current state, the game
+        # session and the moving background of the menus. If a seed is given the games are random in the same way
+        # every time. If a replay folder is given every game is saved into it as a replay file. If a replay is given
+        # it is played back at normal speed instead, and the coins and score of it are not saved to the profile. If a
+        # checkpoint file is given the game starts playing from it, and every new game starts from it again. The
+        # checkpoint keys only work then, and the coins and score are not saved either, so going back to a checkpoint
+        # can not be used to collect the same coins again or to set a higher score.
+        self.pacer = FramePacer(STATE_FRAME_RATES)
+        self.scenes = build_scenes(profile)
+        self.session = SESSION_ENGINES[engine](None if replay or checkpoint else profile, seed)
+        self.session.profiler = frame_profiler
+        self.profile_log = profile_log
+        self.show_profiler = False
+        self.running = True
+        self.state = 'HOME'
+        # This is the time that has passed but has not been simulated yet. Each tick uses up TICK_SECONDS of it.
+        self.accumulator = 0.0
+        # These are the seconds since the last frame and whether the last frame sent nothing to the display.
+        self.frame_seconds = 0.0
+        self.idle = False
+        self.game_over_background = None
+        # This is how many pixels the menu background has scrolled to the left and the pixel it was last drawn at.
+        self.menu_scroll = 0.0
+        self.background_drawn_at = None
+        # This is the state whose frame is on the display. A new state always sends the whole screen.
+        self.presented_state = None
+        self.replay_folder = replay_folder
+        self.replay = replay
+        # These are the replay of the game that is being recorded and the input of the replay that is being played.
+        self.recording = None
+        self.replay_inputs = None
+        # This is the file the checkpoint keys save to and load from, if checkpoints are turned on.
+        self.checkpoint_path = checkpoint
+        self.start_from_checkpoint = checkpoint is not None
+
+    def go_to(self, state):
+        # This is to go to another page.
+        self.state = state
+
+    def start_game(self):
+        # This is for the playing game state when the user wants to play the game. It starts a new game and changes
+        # the music to the game play music.
+        self.state = 'PLAYING'
+        finish_loading()
+        if self.replay is not None:
+            self.session.reset(self.replay.difficulty, self.replay.seed)
+            self.replay_inputs = self.replay.inputs()
+        elif self.start_from_checkpoint:
+            self.session.reset(DIFFICULTY_LEVELS[CURRENT_DIFFICULTY])
+            self.load_checkpoint()
+        else:
+            # Every game starts from a seed of its own, so it can be played again from a replay.
+            seed = self.session.rng.getrandbits(32)
+            self.session.reset(DIFFICULTY_LEVELS[CURRENT_DIFFICULTY], seed)
+            if self.replay_folder is not None:
+                self.recording = Replay(self.session.difficulty, seed)
+        self.accumulator = 0.0
+        self.pacer.restart()
+        play_music(GAME_PLAY_MUSIC)
+
+    def next_difficulty(self):
+        # This is to change the difficulty of the game when the user clicks the level button.
+        global CURRENT_DIFFICULTY
+        CURRENT_DIFFICULTY = (CURRENT_DIFFICULTY + 1) % len(DIFFICULTY_LEVELS)
+
+    def leave_store(self):
+        # Leaving the store is a safe point to save the purchases and equips straight away.
+        profile_saver.flush()
+        self.state = 'HOME'
+
+    def go_home(self):
+        # This is to go back to the home page from the game over page, incase the user wants to go to a different page
+        # or change the difficulty.
+        play_music(HOME_PAGE_MUSIC)
+        self.state = 'HOME'
+
+    def quit(self):
+        # This will close the application.
+        self.running = False
+
+    def end_game(self):
+        # This is to change the music and go to the GAME OVER state to show that the game is over. The game over is a
+        # safe point to save the coins and the highest score to the disk.
+        self.session.bank_coins()
+        if self.replay is None and not self.start_from_checkpoint:
+            profile.record_score(self.session.score)
+        profile_saver.flush()
+        self.save_recording()
+        rect_surface = pygame.Surface((600, 800))
+        rect_surface.set_alpha(150)
+        rect_surface.fill((0, 0, 0))
+        screen.blit(rect_surface, (0, 0))
+        # The last frame of the game with the dark layer over it is kept to go under the game over page.
+        self.game_over_background = screen.copy()
+        play_music(GAME_OVER_MUSIC)
+        self.state = 'GAME_OVER'
+
+    def save_recording(self):
+        # This is to save the replay of the game that was just played, if replays are being recorded.
+        if self.recording is None:
+            return
+        self.recording.finish(self.session)
+        os.makedirs(self.replay_folder, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{self.recording.seed}{REPLAY_EXTENSION}"
+        self.recording.save(os.path.join(self.replay_folder, name))
+        self.recording = None
+
+    def save_checkpoint(self):
+        # This is to save the game that is being played to the checkpoint file. If it can not be written the game just
+        # carries on without it.
+        try:
+            write_file_atomic(self.checkpoint_path, self.session.snapshot())
+        except OSError:
+            pass
+
+    def load_checkpoint(self):
+        # This is to carry on from the checkpoint file. It only happens when the game was started with a checkpoint, so
+        # the session has no profile and the coins and score of the game carried on from here are not added to the
+        # profile. Games played from a checkpoint are not recorded as replays either, because a replay can not start
+        # from one. If the file can not be loaded the game carries on as it was.
+        try:
+            with open(self.checkpoint_path, 'rb') as f:
+                self.session.restore(f.read())
+        except (OSError, ValueError):
+            return
+        self.accumulator = 0.0
+
+    def draw_menu_background(self):
+        # This displays the movement of the background image of the menus.
+        menu_scroller = get_scroller(HOME_BACKGROUND_PATH, vertical=False)
+        self.menu_scroll = (self.menu_scroll + MENU_SCROLL_SPEED * self.frame_seconds) % menu_scroller.length
+        drawn_at = menu_scroller.draw(screen, self.menu_scroll)
+        # The background only moves on the screen when it reaches the next whole pixel.
+        if drawn_at != self.background_drawn_at:
+            self.background_drawn_at = drawn_at
+            screen_updates.add_all()
+
+    def read_events(self):
+        # The events are read once at the start of each frame. If nothing changed in the last frame the game sleeps
+        # until something happens. On the pages with the moving background it only sleeps until the background has
+        # moved by one pixel.
+        if not self.idle or self.state == 'PLAYING':
+            return pygame.event.get()
+        frame_profiler.begin('idle')
+        if self.state == 'GAME_OVER':
+            events = self.pacer.wait_for_events(IDLE_TIMEOUT_MS)
+        else:
+            events = self.pacer.wait_for_events(1000 // MENU_SCROLL_SPEED)
+        frame_profiler.end()
+        return events
+
+    def run(self):
+        # This is the main loop of the game. Each frame the page of the current state handles the events and is drawn,
+        # then the changed parts of the screen are sent to the display. Every frame is timed by the frame profiler
+        # when its overlay is shown with F3 or when a profile log file is given. Each page is kept to its frame rate
+        # cap.
+        if self.profile_log:
+            frame_profiler.open_log(self.profile_log)
+        frame_profiler.enabled = self.profile_log is not None
+        play_music(HOME_PAGE_MUSIC)
+        if self.replay is not None or self.start_from_checkpoint:
+            self.start_game()
+
+        while self.running:
+            events = self.read_events()
+            # This is the state the frame is drawn for. A click can change the state after the frame is drawn.
+            drawn_state = self.state
+            scene = self.scenes[drawn_state]
+            frame_profiler.begin('events')
+            for event in events:
                 if event.type == pygame.QUIT:
-                    running = False
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    mouse_pos = event.pos
-                    if pygame.Rect(200, 400, 200, 80).collidepoint(mouse_pos):
-                        state = 'PLAYING'
-                        total_coins = load_skins()[2]
-                        total_coins += player.collected_coins
-                        player.save_total_coins()
-                        high_score = load_highest_score()
-                        if score > high_score:
-                            save_highest_score(score)
-                        player = Player()
-                        player.ammo = DIFFICULTY_SETTINGS[DIFFICULTY_LEVELS[CURRENT_DIFFICULTY]]["ammo"]
-                        obstacle_speed = DIFFICULTY_SETTINGS[DIFFICULTY_LEVELS[CURRENT_DIFFICULTY]]["obstacle_speed"]
-                        obstacles = []
-                        bullets = []
-                        ammo_pickups = []
-                        coins = []
-                        explosions = []
-                        score = 0
-                        play_music(GAME_PLAY_MUSIC)
-                    elif pygame.Rect(200, 500, 200, 80).collidepoint(mouse_pos):
-                        total_coins = load_skins()[2]
-                        total_coins += player.collected_coins
-                        player.save_total_coins()
-                        high_score = load_highest_score()
-                        if score > high_score:
-                            save_highest_score(score)
-                        stop_music()
-                        play_music(HOME_PAGE_MUSIC)
-                        state = 'HOME'
-    pygame.quit()
-
-
-game_loop()  # This is to call the main function of the game loop.
+                    self.running = False
+                elif event.type == pygame.KEYDOWN and event.key == PROFILER_KEY:
+                    self.show_profiler = not self.show_profiler
+                    screen_updates.add_all()
+                elif event.type != pygame.MOUSEBUTTONDOWN:
+                    scene.handle_event(self, event)
+            frame_profiler.end()
+
+            scene.frame(self)
+
+            # The clicks are handled after the page is drawn, the same as the hover.
+            frame_profiler.begin('events')
+            for event in events:
+                if event.type == pygame.MOUSEBUTTONDOWN and self.state == drawn_state:
+                    scene.handle_event(self, event)
+            frame_profiler.end()
+            # A music track that was waiting to finish decoding starts fading in here.
+            audio_manager.update()
+
+            if self.show_profiler:
+                # The overlay is drawn last so it is on top of everything else.
+                screen_updates.add(frame_profiler.draw_overlay(screen, self.pacer.fps(),
+                                                               self.pacer.frame_rate(drawn_state)))
+            if drawn_state == 'PLAYING' or drawn_state != self.presented_state:
+                # The game background scrolls every tick, so the whole screen is sent while playing.
+                screen_updates.add_all()
+                self.presented_state = drawn_state
+            frame_profiler.begin('flip')
+            self.idle = not screen_updates.present()
+            frame_profiler.end()
+            STARTUP_TIMES.setdefault("home_page", time.perf_counter() - PROCESS_START)
+            frame_profiler.end_frame(self.state)
+            # The profiler is only turned on or off between frames so a phase is never half timed.
+            frame_profiler.enabled = self.show_profiler or self.profile_log is not None
+
+            self.frame_seconds = min(self.pacer.tick(drawn_state), MAX_FRAME_SECONDS)
+            if self.state == 'PLAYING':
+                self.accumulator += self.frame_seconds
+        # Quitting is the last safe point, so the saver is stopped and anything that has not been saved yet is written.
+        # A game that was quit in the middle is saved as a replay too, up to where it got.
+        self.save_recording()
+        if self.profile_log:
+            startup_ms = {name: round(seconds * 1000, 1) for name, seconds in STARTUP_TIMES.items()}
+            print(f"Startup times in ms: {json.dumps(startup_ms)}")
+            print(f"Frame rates: {json.dumps(self.pacer.achieved_frame_rates())}")
+        frame_profiler.close_log()
+        profile_saver.stop()
+        asset_loader.stop()
+        pygame.quit()
+
+
+def game_loop(seed=None, profile_log=None, engine='objects', replay_folder=None, replay=None, checkpoint=None):
+    # This is the main loop function for when the game plays. It makes the game and runs it until the user quits.
+    Game(seed, profile_log, engine, replay_folder, replay, checkpoint).run()
+
+
+def parse_args(argv=None):
+    # This is to read the options the game was started with from the command line.
+    parser = argparse.ArgumentParser(description="Raccoon Madness")
+    parser.add_argument('--headless', action='store_true',
+                        help="play one game with the bot and no window or sound, then print the result")
+    parser.add_argument('--seed', type=int, default=None, help="seed for the random generator of the games")
+    parser.add_argument('--difficulty', choices=DIFFICULTY_LEVELS, default=DIFFICULTY_LEVELS[0],
+                        help="difficulty of the headless game")
+    parser.add_argument('--max-ticks', type=int, default=None, help="stop the headless game after this many ticks")
+    parser.add_argument('--engine', choices=list(SESSION_ENGINES), default='objects',
+                        help="keep the entities as objects or in NumPy arrays, which needs NumPy")
+    parser.add_argument('--bake-assets', action='store_true',
+                        help="decode and scale every image ahead of time so the game starts faster, then exit")
+    parser.add_argument('--menu-fps', type=int, default=None,
+                        help="the most frames per second the menus are drawn at, lower uses less power")
+    parser.add_argument('--record-replays', metavar='FOLDER', default=None,
+                        help="save every game that is played as a replay file in this folder")
+    parser.add_argument('--replay', metavar='FILE', default=None,
+                        help="play a replay file back at normal speed, or as fast as possible with --headless")
+    parser.add_argument('--checkpoint', metavar='FILE', default=None,
+                        help="start playing from this checkpoint file, which F5 saves to and F9 loads, or carry on "
+                             "from it with --headless. The coins and score of these games are not saved")
+    parser.add_argument('--profile-log', default=None,
+                        help="write the frame profiler's phase times and counters for every frame to a .csv or .jsonl file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    # This is the start of the game. In headless mode it plays one game and prints the final score, coins and ticks.
+    # Otherwise it loads the player profile, opens the window and runs the game loop.
+    global profile, profile_saver
+    args = parse_args(argv)
+    if args.engine == 'numpy' and numpy is None:
+        sys.exit("The numpy engine needs NumPy, install it with: pip install numpy")
+    replay = None
+    if args.replay:
+        try:
+            replay = Replay.load(args.replay)
+        except (OSError, ValueError) as error:
+            sys.exit(f"Could not load the replay: {error}")
+    checkpoint = None
+    # In the window a checkpoint file that does not exist yet is fine, because F5 makes it.
+    if args.checkpoint and (args.headless or os.path.exists(args.checkpoint)):
+        try:
+            with open(args.checkpoint, 'rb') as f:
+                checkpoint = f.read()
+            # The checkpoint is loaded into a spare game first, so a broken file is found before the window opens.
+            GameSession().restore(checkpoint)
+        except (OSError, ValueError) as error:
+            sys.exit(f"Could not load the checkpoint: {error}")
+    if args.headless and replay is not None:
+        print(json.dumps(play_replay(SESSION_ENGINES[args.engine](), replay)))
+        return
+    if args.headless:
+        seed = 0 if args.seed is None else args.seed
+        print(json.dumps(run_headless(args.difficulty, seed, args.max_ticks, engine=args.engine,
+                                      checkpoint=checkpoint)))
+        return
+    profile_saver = ProfileSaver()
+    profile = profile_saver.load()
+    if args.bake_assets:
+        print(f"Baked {bake_assets()} images into {BAKED_ASSET_FOLDER}")
+        # The check needs a display to convert the images, so a hidden one is made.
+        pygame.display.init()
+        pygame.display.set_mode((1, 1), pygame.HIDDEN)
+        if not check_baked_atlas():
+            sys.exit("The sprite atlas made from the baked images is different from the one made from the PNGs")
+        print("The sprite atlas is the same from the baked images as from the PNGs")
+        return
+    profile_saver.start()
+    if args.menu_fps:
+        for state in STATE_FRAME_RATES:
+            if state != 'PLAYING':
+                STATE_FRAME_RATES[state] = args.menu_fps
+    init_window()
+    game_loop(args.seed, args.profile_log, args.engine, args.record_replays, replay, args.checkpoint)
+
+
+if __name__ == '__main__':
+    main()  # This is to call the main function of the game.